@@ -59,6 +59,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'django.contrib.humanize',
     'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     'channels',
@@ -119,6 +120,16 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Requests write in short transactions from several threads; take the write
+                # lock when one starts, so they wait for each other instead of failing with
+                # "database is locked"
+                'transaction_mode': 'IMMEDIATE',
+            },
+            'TEST': {
+                # A file rather than memory, so tests can write from several threads
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
         }
     }
 
@@ -186,9 +197,11 @@ LOGOUT_REDIRECT_URL = 'login'
 
 # Channel Layers Configuration (using Redis)
 # Make sure you have Redis server running
+# LocalFanoutChannelLayer is RedisChannelLayer, except group messages cross Redis once per
+# process and are copied to that process's sockets in memory (see tracker/channel_layers.py)
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "tracker.channel_layers.LocalFanoutChannelLayer",
         "CONFIG": {
             # Use environment variable or default to localhost
             "hosts": [os.environ.get('REDIS_URL', 'redis://localhost:6379/1')],
@@ -196,6 +209,45 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Live stats: profile changes within this many seconds are merged into one group
+# message per process. 0 sends every change on its own.
+LIVE_STATS_BROADCAST_WINDOW = float(os.environ.get('LIVE_STATS_BROADCAST_WINDOW', '0.25'))
+# How many recent live stats events each process keeps for clients resuming with ?since=<seq>
+LIVE_STATS_REPLAY_BUFFER = int(os.environ.get('LIVE_STATS_REPLAY_BUFFER', '500'))
+
+# Cache Configuration
+# Live stats sequence numbers live in the default cache, so it must be shared between
+# Daphne processes in production. Use Redis when REDIS_URL is set, local memory otherwise.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# Rank index behind "You are #N of M" (tracker/rank_index.py). The in-memory backend only
+# sees updates made by its own process, so share a Redis sorted set when REDIS_URL is set.
+if os.environ.get('REDIS_URL'):
+    RANK_INDEX_BACKEND = 'tracker.rank_index.RedisRankBackend'
+    RANK_INDEX_REDIS_URL = os.environ['REDIS_URL']
+else:
+    RANK_INDEX_BACKEND = 'tracker.rank_index.InMemoryRankBackend'
+
+# Rendered dashboard fragments (tracker/fragment_cache.py). The in-memory backend keeps
+# fragments and hit/miss counters per process, so share them through Redis when REDIS_URL is set.
+if os.environ.get('REDIS_URL'):
+    FRAGMENT_CACHE_BACKEND = 'tracker.fragment_cache.RedisFragmentBackend'
+    FRAGMENT_CACHE_REDIS_URL = os.environ['REDIS_URL']
+else:
+    FRAGMENT_CACHE_BACKEND = 'tracker.fragment_cache.InMemoryFragmentBackend'
+
 # Crispy Forms settings
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
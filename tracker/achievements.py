@@ -1,7 +1,18 @@
 # tracker/achievements.py
 
+from collections import Counter, defaultdict, namedtuple
 from django.contrib import messages
-from .models import User, Achievement, UserAchievement, UserProfile, Completion, Section, Lesson, UserStreak
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Subquery
+from .models import User, Achievement, LearnerStats, UserAchievement, UserProfile
+from .catalog import catalog_version, get_catalog
+from .completion_bits import completion_bitmaps
+from .learner_state import LearnerState
+from .learner_stats import (compute_learner_stats, per_user, rebuild_learner_stats, record_achievement,
+                            record_achievements_in_bulk, record_daily_points)
+from .scoring import add_points
+from .version_stamps import bump_version, current_version
 
 # Predefined achievement slugs (must match those created in the admin)
 ACHIEVEMENT_SLUGS = {
@@ -18,116 +29,328 @@ ACHIEVEMENT_SLUGS = {
     'COURSE_COMPLETED': 'foundations-course-completed',
 }
 
+class UserStats:
+    """Snapshot of everything achievement rules look at for one user.
+
+    load() takes it from the request's LearnerState, which reads the user's LearnerStats
+    row (its completion bitmap gives the per-section counts) with one query if it hasn't
+    already; section sizes come from the course catalog. That holds however many rules
+    or achievements there are.
+    """
+
+    def __init__(self, learner_stats, points, section_totals, section_completions):
+        self.points = points
+        self.completion_count = learner_stats.completion_count
+        self.project_count = learner_stats.project_count
+        self.achievement_count = learner_stats.achievement_count
+        self.current_streak = learner_stats.current_streak
+        self.longest_streak = learner_stats.longest_streak
+        self.section_completions = section_completions # section id -> lessons completed there
+        self.section_totals = section_totals # section id -> lessons in the section
+        self.total_lessons = sum(section_totals.values())
+        # Lessons of the current course completed (completion_count also counts removed ones)
+        self.lessons_completed = sum(section_completions.values())
+
+    @classmethod
+    def load(cls, state):
+        """From a LearnerState. Points come from the LearnerStats mirror, which is written
+        with every points change."""
+        learner_stats = state.learner_stats
+        return cls(learner_stats, learner_stats.points, load_section_totals(), state.completed_lessons.section_counts())
+
+    def completed_in_section(self, section_id):
+        return self.section_completions.get(section_id, 0)
+
+    def closest_section(self):
+        """(completed, total) of the non-empty section nearest to completion, or (0, 0) if there is none."""
+        progress = [(self.completed_in_section(section_id), total) for section_id, total in self.section_totals.items() if total]
+        return max(progress, key=lambda item: (item[0] / item[1], item[1]), default=(0, 0))
+
+def load_section_totals():
+    """{section id: lessons in the section}, from the course catalog (no queries)."""
+    return get_catalog().section_totals
+
+### Events ###
+
+# What just happened to the user; each rule is only evaluated for the events it lists
+LESSON_COMPLETED = 'lesson_completed'
+PROJECT_COMPLETED = 'project_completed'
+STREAK_CHANGED = 'streak_changed'
+POINTS_CHANGED = 'points_changed'
+CHALLENGE_COMPLETED = 'challenge_completed'
+PAGE_VIEWED = 'page_viewed'
+ALL_EVENTS = frozenset({LESSON_COMPLETED, PROJECT_COMPLETED, STREAK_CHANGED, POINTS_CHANGED,
+                        CHALLENGE_COMPLETED, PAGE_VIEWED})
+
+### Rules ###
+
+AchievementRule = namedtuple('AchievementRule', ['predicate', 'progress', 'events'])
+
+# Achievement slug -> AchievementRule. progress(stats, achievement) returns (current, target)
+# for progress indicators; predicate(stats, achievement) decides whether it's unlocked,
+# which is once current reaches a non-zero target.
+ACHIEVEMENT_RULES = {}
+
+def register_rule(slug, progress, events):
+    def predicate(stats, achievement):
+        current, target = progress(stats, achievement)
+        return target > 0 and current >= target
+    ACHIEVEMENT_RULES[slug] = AchievementRule(predicate, progress, frozenset(events))
+
+def rules_for(events):
+    """Slugs of the rules that subscribe to any of events."""
+    return {slug for slug, rule in ACHIEVEMENT_RULES.items() if rule.events & events}
+
+def at_least(attribute, threshold):
+    """Rule: the UserStats attribute has reached threshold."""
+    return lambda stats, achievement: (min(getattr(stats, attribute), threshold), threshold)
+
+def section_completed(stats, achievement):
+    """Rule: every lesson in the achievement's section is complete."""
+    if achievement.section_id is None:
+        return (0, 0)
+    return (stats.completed_in_section(achievement.section_id), stats.section_totals.get(achievement.section_id, 0))
+
+def any_section_completed(stats, achievement):
+    """Rule: every lesson in some section is complete; progress shows the closest one."""
+    return stats.closest_section()
+
+def course_completed(stats, achievement):
+    return (min(stats.lessons_completed, stats.total_lessons), stats.total_lessons)
+
+register_rule(ACHIEVEMENT_SLUGS['FIRST_LESSON'], at_least('completion_count', 1), [LESSON_COMPLETED])
+register_rule(ACHIEVEMENT_SLUGS['FIRST_PROJECT'], at_least('project_count', 1), [PROJECT_COMPLETED])
+# Removing or moving a lesson can complete a section (or the course) without the user
+# doing anything, so page views check the rules that depend on the course's shape, once
+# per catalog version (see the settled cache below)
+register_rule(ACHIEVEMENT_SLUGS['HTML_FOUNDATION_COMPLETE'], section_completed, [LESSON_COMPLETED, PAGE_VIEWED])
+register_rule(ACHIEVEMENT_SLUGS['CSS_FOUNDATION_COMPLETE'], section_completed, [LESSON_COMPLETED, PAGE_VIEWED])
+register_rule(ACHIEVEMENT_SLUGS['JS_BASICS_COMPLETE'], section_completed, [LESSON_COMPLETED, PAGE_VIEWED])
+register_rule(ACHIEVEMENT_SLUGS['PERFECT_SECTION'], any_section_completed, [LESSON_COMPLETED, PAGE_VIEWED])
+register_rule(ACHIEVEMENT_SLUGS['TEN_DAY_STREAK'], at_least('current_streak', 10), [STREAK_CHANGED])
+register_rule(ACHIEVEMENT_SLUGS['THIRTY_DAY_STREAK'], at_least('current_streak', 30), [STREAK_CHANGED])
+register_rule(ACHIEVEMENT_SLUGS['POINT_MILESTONE_100'], at_least('points', 100), [POINTS_CHANGED])
+register_rule(ACHIEVEMENT_SLUGS['POINT_MILESTONE_500'], at_least('points', 500), [POINTS_CHANGED])
+register_rule(ACHIEVEMENT_SLUGS['COURSE_COMPLETED'], course_completed, [LESSON_COMPLETED, PAGE_VIEWED])
+
+### Settled cache ###
+
+# Per user, (settled, checked) rule slugs. Settled rules can't unlock anything:
+# achievements already earned, plus rules without an Achievement row. An event whose
+# rules are all settled needs no queries. Checked rules were evaluated against the
+# user's progress and the current course; a page view changes neither, so it only
+# evaluates rules that aren't checked yet. The key carries the achievement catalog
+# version, bumped whenever an Achievement changes, and the course catalog version, so
+# either change drops every entry.
+SETTLED_CACHE_TIMEOUT = 24 * 60 * 60
+CATALOG_VERSION_CACHE_KEY = 'achievements:catalog_version'
+
+def _settled_cache_key(user_id):
+    version = current_version(CATALOG_VERSION_CACHE_KEY)
+    return f'achievements:settled:{version}:{catalog_version()}:{user_id}'
+
+def forget_settled_achievements(user_id):
+    """Drops the user's settled rules, e.g. after their achievements were deleted."""
+    cache.delete(_settled_cache_key(user_id))
+
+def bump_achievement_catalog():
+    """Invalidates every user's settled rules after an Achievement was added, changed or removed."""
+    bump_version(CATALOG_VERSION_CACHE_KEY)
+
+def achievements_with_earned(user):
+    """Every Achievement, each annotated with `earned` for user and when it was
+    `awarded_at` (None if it wasn't), in one query."""
+    awards = UserAchievement.objects.filter(user=user, achievement=OuterRef('pk'))
+    return Achievement.objects.annotate(
+        earned=Exists(awards),
+        awarded_at=Subquery(awards.values('awarded_at')[:1]),
+    )
+
+def evaluate_achievements(stats, achievements, earned_ids, slugs):
+    """Returns the achievements not in earned_ids whose rules (limited to slugs) stats now satisfies.
+
+    Rewards count towards the snapshot's points as soon as they're unlocked, so a bonus
+    that crosses a points milestone unlocks the milestone in the same evaluation.
+    """
+    unearned = [achievement for achievement in achievements
+                if achievement.id not in earned_ids and achievement.achievement_slug in ACHIEVEMENT_RULES]
+    unlocked = []
+    progress = True
+    while progress:
+        progress = False
+        for achievement in unearned:
+            if achievement in unlocked or achievement.achievement_slug not in slugs:
+                continue
+            if ACHIEVEMENT_RULES[achievement.achievement_slug].predicate(stats, achievement):
+                unlocked.append(achievement)
+                stats.points += achievement.points_reward
+                stats.achievement_count += 1
+                if achievement.points_reward:
+                    slugs = slugs | rules_for({POINTS_CHANGED})
+                progress = True
+    return unlocked
+
+def achievement_progress(stats, achievement):
+    """(current, target) towards achievement for the stats snapshot, or None if no rule handles it."""
+    rule = ACHIEVEMENT_RULES.get(achievement.achievement_slug)
+    if rule is None:
+        return None
+    current, target = rule.progress(stats, achievement)
+    return (min(current, target), target) if target else None
+
+### Awarding ###
+
+def award_achievements(user, achievements, request=None):
+    """Awards whichever of achievements the user hasn't earned yet, with one bulk insert
+    and one points increment. Returns the achievements awarded by this call.
+
+    Runs in a short transaction of its own, after the caller's evaluation: the user's
+    profile row is locked only for these few writes, so two requests that both unlocked
+    an achievement can't both award it.
+    """
+    if not achievements:
+        return []
+    with transaction.atomic():
+        if UserProfile.objects.select_for_update().filter(user_id=user.id).values_list('id', flat=True).first() is None:
+            return []
+        earned_ids = set(UserAchievement.objects.filter(user=user, achievement__in=achievements)
+                         .values_list('achievement_id', flat=True))
+        achievements = [achievement for achievement in achievements if achievement.id not in earned_ids]
+        if not achievements:
+            return []
+        UserAchievement.objects.bulk_create([UserAchievement(user=user, achievement=achievement) for achievement in achievements])
+        bonus = sum(achievement.points_reward for achievement in achievements)
+        if bonus:
+            add_points(user, bonus)
+            record_daily_points(user, bonus)
+        record_achievement(user, len(achievements))
+    if request:
+        for achievement in achievements:
+            messages.success(request,
+                f"🎉 Achievement Unlocked: {achievement.title}! (+{achievement.points_reward} points)")
+    return achievements
+
 def award_achievement(user, achievement_slug, request=None):
     """Awards an achievement to a user if not already awarded and updates points."""
-    try:
-        achievement = Achievement.objects.get(achievement_slug=achievement_slug)
-        user_achievement, created = UserAchievement.objects.get_or_create(
-            user=user,
-            achievement=achievement
-        )
-        if created:
-            profile = UserProfile.objects.get(user=user)
-            profile.total_points += achievement.points_reward
-            profile.save()
-            if request:
-                messages.success(request, 
-                    f"🎉 Achievement Unlocked: {achievement.title}! (+{achievement.points_reward} points)")
-            # print(f"Awarded '{achievement.title}' to {user.username}") # For server logs
-            return True # Indicates achievement was newly awarded
-    except Achievement.DoesNotExist:
-        # print(f"Attempted to award non-existent achievement: {achievement_slug}") # For server logs
-        pass
-    except UserProfile.DoesNotExist:
-        # print(f"UserProfile not found for {user.username} when awarding achievement.")
-        pass
-    return False # Not newly awarded or error
-
-def check_and_award_achievements(user, request=None, 
-                                 completion_instance=None, # Add default=None explicitly
-                                 profile=None, 
-                                 streak=None, 
-                                 daily_challenge_completed=False, 
-                                 view_context=None 
-                                 ):
-    """Checks all relevant conditions and awards achievements to the user."""
+    achievement = achievements_with_earned(user).filter(achievement_slug=achievement_slug).first()
+    if achievement is None or achievement.earned:
+        return False # Not newly awarded or error
+    return bool(award_achievements(user, [achievement], request)) # Indicates achievement was newly awarded
+
+def check_and_award_achievements(user, request=None, events=ALL_EVENTS, state=None):
+    """Evaluates the rules subscribed to events and awards what's newly unlocked.
+
+    Costs no queries when no rule subscribes to events, or when the user has already
+    settled every rule that does (or, for a page view, checked them since the course
+    last changed; see the settled cache above). Otherwise runs a fixed
+    number of queries however many achievements exist: the stats snapshot, the
+    achievements with the user's earned flags, and (only when something unlocks) the
+    award. Nothing is locked while evaluating. Returns the newly awarded achievements.
+
+    state is the request's LearnerState, if it has one; it's refreshed after an award.
+    """
     if not user or not user.is_authenticated: # Ensure user is valid
-        return
-
-    # 1. First Lesson Completed
-    if Completion.objects.filter(user=user).count() == 1:
-        award_achievement(user, ACHIEVEMENT_SLUGS['FIRST_LESSON'], request)
-
-    # 2. First Project Completed
-    if completion_instance and completion_instance.lesson.lesson_type == 'Project':
-        if Completion.objects.filter(user=user, lesson__lesson_type='Project').count() == 1:
-            award_achievement(user, ACHIEVEMENT_SLUGS['FIRST_PROJECT'], request)
-
-    # 3. Section Completion Achievements (example: HTML, CSS, JS)
-    # This requires knowing section titles or having specific slugs for sections.
-    # Assuming section titles are somewhat stable or we add slugs to Section model later.
-    completed_lesson_ids = Completion.objects.filter(user=user).values_list('lesson_id', flat=True)
-    
-    # Check for HTML Section (assuming its title or a way to identify it)
-    try:
-        html_section = Section.objects.get(title__icontains="HTML Foundations") # Fragile, better to use slug if added
-        html_lessons_total = html_section.lessons.count()
-        html_lessons_completed = html_section.lessons.filter(id__in=completed_lesson_ids).count()
-        if html_lessons_total > 0 and html_lessons_total == html_lessons_completed:
-            award_achievement(user, ACHIEVEMENT_SLUGS['HTML_FOUNDATION_COMPLETE'], request)
-    except Section.DoesNotExist:
-        pass # Section not found, can't award
-
-    # Similar checks for CSS Foundations, JS Basics would go here...
-    try:
-        css_section = Section.objects.get(title__icontains="CSS Foundations")
-        css_lessons_total = css_section.lessons.count()
-        css_lessons_completed = css_section.lessons.filter(id__in=completed_lesson_ids).count()
-        if css_lessons_total > 0 and css_lessons_total == css_lessons_completed:
-            award_achievement(user, ACHIEVEMENT_SLUGS['CSS_FOUNDATION_COMPLETE'], request)
-    except Section.DoesNotExist:
-        pass
-    
-    try:
-        js_section = Section.objects.get(title__icontains="JavaScript Basics")
-        js_lessons_total = js_section.lessons.count()
-        js_lessons_completed = js_section.lessons.filter(id__in=completed_lesson_ids).count()
-        if js_lessons_total > 0 and js_lessons_total == js_lessons_completed:
-            award_achievement(user, ACHIEVEMENT_SLUGS['JS_BASICS_COMPLETE'], request)
-    except Section.DoesNotExist:
-        pass
-
-    # 4. Perfect Section (any section fully completed)
-    if completion_instance: # Check only if a lesson was just completed
-        section_just_completed = completion_instance.lesson.section
-        lessons_in_section_total = section_just_completed.lessons.count()
-        lessons_in_section_completed_by_user = section_just_completed.lessons.filter(id__in=completed_lesson_ids).count()
-        if lessons_in_section_total > 0 and lessons_in_section_total == lessons_in_section_completed_by_user:
-            # Check if this is the *first time* this specific section was perfected by the user for this achievement
-            # This specific "perfect section" achievement is generic and can be awarded multiple times
-            # if we don't link it to a specific section object.
-            # For now, let's assume a general "Perfect Section" can be awarded once.
-            # To make it per-section, the Achievement model would need a ForeignKey to Section.
-            award_achievement(user, ACHIEVEMENT_SLUGS['PERFECT_SECTION'], request)
-
-    # 5. Streak Achievements
-    user_streak = UserStreak.objects.filter(user=user).first()
-    if user_streak:
-        if user_streak.current_streak >= 10:
-            award_achievement(user, ACHIEVEMENT_SLUGS['TEN_DAY_STREAK'], request)
-        if user_streak.current_streak >= 30:
-            award_achievement(user, ACHIEVEMENT_SLUGS['THIRTY_DAY_STREAK'], request)
-    
-    # 6. Point Milestones
-    user_profile = UserProfile.objects.filter(user=user).first()
-    if user_profile:
-        if user_profile.total_points >= 100:
-            award_achievement(user, ACHIEVEMENT_SLUGS['POINT_MILESTONE_100'], request)
-        if user_profile.total_points >= 500:
-            award_achievement(user, ACHIEVEMENT_SLUGS['POINT_MILESTONE_500'], request)
-
-    # 7. Course Completed
-    total_lessons_in_course = Lesson.objects.count()
-    user_total_completed_lessons = Completion.objects.filter(user=user).count()
-    if total_lessons_in_course > 0 and user_total_completed_lessons >= total_lessons_in_course:
-        award_achievement(user, ACHIEVEMENT_SLUGS['COURSE_COMPLETED'], request) 
\ No newline at end of file
+        return []
+    slugs = rules_for(frozenset(events))
+    if not slugs:
+        return []
+    cache_key = _settled_cache_key(user.id)
+    settled, checked = cache.get(cache_key) or (set(), set())
+    slugs -= settled
+    if set(events) == {PAGE_VIEWED}:
+        slugs -= checked
+    if not slugs:
+        return []
+
+    state = state or LearnerState(user)
+    stats = UserStats.load(state)
+    achievements = state.achievements
+    earned_ids = {achievement.id for achievement in achievements if achievement.earned}
+    unlocked = evaluate_achievements(stats, achievements, earned_ids, slugs)
+    awarded = award_achievements(user, unlocked, request)
+    if awarded:
+        state.refresh()
+
+    settled = set(ACHIEVEMENT_RULES) - {achievement.achievement_slug for achievement in achievements}
+    settled |= {achievement.achievement_slug for achievement in achievements if achievement.earned}
+    # Earned now, whether this call or a concurrent one awarded them
+    settled |= {achievement.achievement_slug for achievement in unlocked}
+    checked = checked | slugs
+    # Only remember awards once they're committed
+    transaction.on_commit(lambda: cache.set(cache_key, (settled, checked), SETTLED_CACHE_TIMEOUT))
+    return awarded
+
+def reevaluate_users(user_ids, slugs=None, dry_run=False):
+    """Re-evaluates the rules in slugs (default: all) for a chunk of users and awards what unlocks.
+
+    For backfills such as a newly added achievement. The chunk's stats, points and earned
+    achievements are batch-loaded in a fixed number of queries without locking anything,
+    and awards are written with one bulk insert plus one aggregated UPDATE for profile
+    points (and one for the LearnerStats counters). Only that write step locks the
+    awarded users' profiles, as award_achievements does, and it skips anything a live
+    request awarded since the evaluation. Returns a Counter of awards per slug.
+    """
+    slugs = set(ACHIEVEMENT_RULES) if slugs is None else set(slugs)
+    achievements = list(Achievement.objects.all())
+    section_totals = load_section_totals()
+
+    points = dict(UserProfile.objects.filter(user_id__in=user_ids).values_list('user_id', 'total_points'))
+    learner_stats = LearnerStats.objects.in_bulk(list(points))
+    missing = [user_id for user_id in points if user_id not in learner_stats]
+    if missing:
+        if not dry_run:
+            rebuild_learner_stats(missing)
+        learner_stats.update(compute_learner_stats(missing))
+    # Section counts come from the completion bitmaps, as on the live path: those follow
+    # lessons that were deleted or moved since the completions were recorded
+    bitmaps = completion_bitmaps(list(learner_stats.values()))
+    earned = defaultdict(set)
+    for user_id, achievement_id in UserAchievement.objects.filter(user_id__in=points).values_list('user_id', 'achievement_id'):
+        earned[user_id].add(achievement_id)
+
+    unlocked = {}
+    for user_id, user_points in points.items():
+        stats = UserStats(learner_stats[user_id], user_points, section_totals, bitmaps[user_id].section_counts())
+        user_unlocked = evaluate_achievements(stats, achievements, earned[user_id], slugs)
+        if user_unlocked:
+            unlocked[user_id] = user_unlocked
+    if dry_run or not unlocked:
+        return Counter(achievement.achievement_slug for user_unlocked in unlocked.values() for achievement in user_unlocked)
+    return _award_in_bulk(unlocked, learner_stats)
+
+def _award_in_bulk(unlocked, learner_stats):
+    """Writes reevaluate_users' awards ({user id: [achievement]}) in one short transaction."""
+    awarded = Counter()
+    with transaction.atomic():
+        list(UserProfile.objects.select_for_update().filter(user_id__in=unlocked).order_by('user_id').values_list('id', flat=True))
+        earned = set(UserAchievement.objects.filter(user_id__in=unlocked).values_list('user_id', 'achievement_id'))
+        awards = [UserAchievement(user_id=user_id, achievement=achievement)
+                  for user_id, user_unlocked in unlocked.items()
+                  for achievement in user_unlocked if (user_id, achievement.id) not in earned]
+        if not awards:
+            return awarded
+        # Writers that don't take the profile lock (the admin, a shell, a data migration) can
+        # still insert the same award; skip those rows instead of failing the whole chunk
+        UserAchievement.objects.bulk_create(awards, ignore_conflicts=True)
+        # ignore_conflicts doesn't say which rows were skipped; ours carry the awarded_at
+        # each instance was stamped with
+        stamped = {(user_id, achievement_id): awarded_at for user_id, achievement_id, awarded_at in
+                   UserAchievement.objects.filter(user_id__in={award.user_id for award in awards})
+                   .values_list('user_id', 'achievement_id', 'awarded_at')}
+        award_counts, bonus = {}, {}
+        for award in awards:
+            if stamped.get((award.user_id, award.achievement_id)) != award.awarded_at:
+                continue
+            award_counts[award.user_id] = award_counts.get(award.user_id, 0) + 1
+            bonus[award.user_id] = bonus.get(award.user_id, 0) + award.achievement.points_reward
+            awarded[award.achievement.achievement_slug] += 1
+        if not award_counts:
+            return awarded
+        UserProfile.objects.filter(user_id__in=bonus).update(total_points=F('total_points') + per_user(bonus))
+        record_achievements_in_bulk(award_counts, bonus)
+        # The bulk UPDATE skips the post_save handlers, so bring the rank index up to date here
+        from .rank_index import get_rank_index
+        changed = [(user_id, total, learner_stats[user_id].is_active) for user_id, total in
+                   UserProfile.objects.filter(user_id__in=bonus).values_list('user_id', 'total_points')]
+        transaction.on_commit(lambda: [get_rank_index().sync_user(*change) for change in changed])
+    return awarded
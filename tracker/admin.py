@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Section, Lesson, Completion, UserStreak, Achievement, UserAchievement, DailyChallenge, UserDailyChallenge
+from .models import UserProfile, Section, Lesson, Completion, UserStreak, Achievement, UserAchievement, DailyChallenge, UserDailyChallenge, DailyChallengeHistory, LearnerStats
 from django.utils import timezone
 from datetime import timedelta
 
@@ -9,6 +9,15 @@ from datetime import timedelta
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'total_points')
 
+@admin.register(LearnerStats)
+class LearnerStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'points', 'completion_count', 'achievement_count', 'current_streak', 'is_active')
+    search_fields = ('user__username',)
+    # Maintained by the app; fix drift with `manage.py rebuild_learner_stats`
+    readonly_fields = ('points', 'completion_count', 'project_count', 'achievement_count',
+                       'current_streak', 'longest_streak', 'last_activity_date', 'is_active',
+                       'challenges_completed', 'challenge_streak', 'longest_challenge_streak', 'last_challenge_date')
+
 @admin.register(Section)
 class SectionAdmin(admin.ModelAdmin):
     list_display = ('title', 'order')
@@ -34,7 +43,7 @@ class UserStreakAdmin(admin.ModelAdmin):
 
 @admin.register(Achievement)
 class AchievementAdmin(admin.ModelAdmin):
-    list_display = ('title', 'achievement_slug', 'points_reward', 'icon_class')
+    list_display = ('title', 'achievement_slug', 'section', 'points_reward', 'icon_class')
     search_fields = ('title', 'achievement_slug')
     prepopulated_fields = {'achievement_slug': ('title',)}
 
@@ -62,14 +71,21 @@ class UserDailyChallengeAdmin(admin.ModelAdmin):
     def reset_selected_challenges(self, request, queryset):
         # Action to allow admin to reset a user's daily challenge (e.g., for testing or if it got stuck)
         # This effectively allows assigning a new one on next dashboard load if conditions met.
-        updated_count = 0
-        for udc in queryset:
-            udc.challenge = None # Or set to a placeholder "no challenge" if you have one
-            udc.completed_date = None
-            udc.assigned_date = timezone.now().date() - timedelta(days=1) # Mark as old
-            udc.current_progress = 0
-            udc.initial_points_at_assignment = 0
-            udc.save()
-            updated_count +=1
+        # One UPDATE for the whole selection; with no challenge the rows aren't archived on rollover.
+        updated_count = queryset.update(
+            challenge=None,
+            completed_date=None,
+            assigned_date=timezone.now().date() - timedelta(days=1), # Mark as old
+            current_progress=0,
+            initial_points_at_assignment=None,
+        )
         self.message_user(request, f"{updated_count} user daily challenges were reset, allowing new assignment.")
-    reset_selected_challenges.short_description = "Reset selected user daily challenges" 
\ No newline at end of file
+    reset_selected_challenges.short_description = "Reset selected user daily challenges" 
+
+@admin.register(DailyChallengeHistory)
+class DailyChallengeHistoryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'day', 'challenge', 'progress', 'completed')
+    list_filter = ('completed', 'day')
+    search_fields = ('user__username',)
+    # Append-only archive written on rollover
+    readonly_fields = ('user', 'day', 'challenge', 'progress', 'completed')
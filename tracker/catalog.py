@@ -0,0 +1,103 @@
+# tracker/catalog.py
+
+import hashlib
+import threading
+from collections import namedtuple
+from functools import partial
+from types import MappingProxyType
+from django.db import transaction
+from .models import Lesson, Section
+from .version_stamps import bump_version, current_version
+
+# The course (sections and their lessons) only changes when an admin edits it or a data
+# migration runs, so each process keeps one immutable CourseCatalog in memory and hot
+# paths read lessons from it instead of querying Section and Lesson. A version stamp in
+# the shared cache is bumped whenever a Section or Lesson is saved or deleted; a process
+# whose catalog carries an older stamp rebuilds it on its next read, with two queries.
+
+CatalogSection = namedtuple('CatalogSection', ['id', 'title', 'order', 'lessons'])
+CatalogLesson = namedtuple('CatalogLesson', ['id', 'title', 'section_id', 'points_value', 'lesson_type', 'url',
+                                             'order', 'position'])
+
+class CourseCatalog:
+    """Sections in order, each with its lessons in order, plus lookups derived from them.
+
+    position is a lesson's index in the whole course, in section and lesson order, and
+    the bit that stands for the lesson in completion bitmaps (see completion_bits.py);
+    layout fingerprints the lessons' positions, so bitmaps record which layout they were
+    built for, and the masks select a section's bits or the whole course's. Nothing here
+    is meant to be changed after it's built: it's shared by every request the process
+    serves.
+    """
+
+    def __init__(self, version, sections, lessons):
+        by_section = {section.id: [] for section in sections}
+        for lesson in lessons:
+            by_section[lesson.section_id].append(lesson)
+        self.version = version
+        self.sections = tuple(CatalogSection(section.id, section.title, section.order, tuple(by_section[section.id]))
+                              for section in sections)
+        self.lessons = tuple(lesson for section in self.sections for lesson in section.lessons)
+        self.sections_by_id = MappingProxyType({section.id: section for section in self.sections})
+        self.lessons_by_id = MappingProxyType({lesson.id: lesson for lesson in self.lessons})
+        self.section_totals = MappingProxyType({section.id: len(section.lessons) for section in self.sections})
+        self.points = MappingProxyType({lesson.id: lesson.points_value for lesson in self.lessons})
+        self.project_ids = frozenset(lesson.id for lesson in self.lessons if lesson.lesson_type == 'Project')
+        self.lesson_count = len(self.lessons)
+        self.total_points = sum(self.points.values())
+        self.layout = hashlib.blake2b(','.join(str(lesson.id) for lesson in self.lessons).encode(),
+                                      digest_size=8).hexdigest()
+        self.section_masks = MappingProxyType({
+            section.id: sum(1 << lesson.position for lesson in section.lessons) for section in self.sections
+        })
+        self.course_mask = (1 << self.lesson_count) - 1
+
+    @classmethod
+    def load(cls, version):
+        """Builds the catalog from the database, in two queries."""
+        sections = list(Section.objects.order_by('order').only('id', 'title', 'order'))
+        rows = (Lesson.objects.order_by('section__order', 'order')
+                .values_list('id', 'title', 'section_id', 'points_value', 'lesson_type', 'url', 'order'))
+        lessons = [CatalogLesson(*row, position=position) for position, row in enumerate(rows)]
+        return cls(version, sections, lessons)
+
+    def lesson(self, lesson_id):
+        """The lesson with lesson_id, or None if the course has no such lesson."""
+        return self.lessons_by_id.get(lesson_id)
+
+    def section_lessons(self, section_id):
+        section = self.sections_by_id.get(section_id)
+        return section.lessons if section else ()
+
+CATALOG_VERSION_CACHE_KEY = 'catalog:version'
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def catalog_version():
+    return current_version(CATALOG_VERSION_CACHE_KEY)
+
+def get_catalog():
+    """The process's CourseCatalog, rebuilt first if the course changed since it was built.
+
+    Costs one cache read when it's current and no database queries.
+    """
+    global _catalog
+    # Read the version before the rows, so a change committed in between is picked up next time
+    version = catalog_version()
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _catalog_lock:
+            catalog = _catalog
+            if catalog is None or catalog.version != version:
+                catalog = _catalog = CourseCatalog.load(version)
+    return catalog
+
+def bump_catalog_version():
+    """Makes every process rebuild its catalog on its next read, after a Section or Lesson changed.
+
+    Bumped right away, for reads later in the same transaction, and again once it commits,
+    as other processes may have rebuilt from the rows as they were before the commit.
+    """
+    bump_version(CATALOG_VERSION_CACHE_KEY)
+    transaction.on_commit(partial(bump_version, CATALOG_VERSION_CACHE_KEY))
@@ -0,0 +1,77 @@
+# tracker/challenge_types.py
+
+from collections import namedtuple
+from django.utils import timezone
+
+# What a lesson completion did, built once by the view from data it already holds, so
+# evaluators never read the database: the lesson's section and type, the points the
+# action earned (lesson plus any achievement bonus), the streak after it and when it happened.
+CompletionEvent = namedtuple('CompletionEvent', ['section_id', 'lesson_type', 'points', 'streak', 'at'])
+
+# DailyChallenge.challenge_type -> evaluator instance
+CHALLENGE_TYPES = {}
+
+def register_challenge_type(cls):
+    """Class decorator adding an evaluator to CHALLENGE_TYPES under cls.code."""
+    CHALLENGE_TYPES[cls.code] = cls()
+    return cls
+
+def get_challenge_type(code):
+    return CHALLENGE_TYPES.get(code)
+
+class ChallengeType:
+    """Evaluator for one DailyChallenge.challenge_type.
+
+    progress() gets the challenge, the progress so far and a CompletionEvent, and returns
+    the new progress. It runs in constant time from its arguments alone; the challenge is
+    complete once progress reaches challenge.target_value.
+    """
+    code = None
+
+    def progress(self, challenge, current, event):
+        raise NotImplementedError
+
+@register_challenge_type
+class CompleteLessons(ChallengeType):
+    code = 'COMPLETE_N_LESSONS'
+
+    def progress(self, challenge, current, event):
+        return current + 1
+
+@register_challenge_type
+class EarnPoints(ChallengeType):
+    code = 'EARN_N_POINTS'
+
+    def progress(self, challenge, current, event):
+        return current + max(0, event.points)
+
+@register_challenge_type
+class CompleteProjects(ChallengeType):
+    code = 'COMPLETE_PROJECT'
+
+    def progress(self, challenge, current, event):
+        return current + 1 if event.lesson_type == 'Project' else current
+
+@register_challenge_type
+class CompleteLessonsFromSection(ChallengeType):
+    code = 'COMPLETE_N_LESSONS_FROM_SECTION'
+
+    def progress(self, challenge, current, event):
+        return current + 1 if event.section_id == challenge.section_id else current
+
+@register_challenge_type
+class EarnPointsBeforeHour(ChallengeType):
+    code = 'EARN_N_POINTS_BEFORE_HOUR'
+
+    def progress(self, challenge, current, event):
+        if challenge.before_hour is None or timezone.localtime(event.at).hour >= challenge.before_hour:
+            return current
+        return current + max(0, event.points)
+
+@register_challenge_type
+class PreserveStreak(ChallengeType):
+    """Complete a lesson today while holding a streak of at least target_value days."""
+    code = 'PRESERVE_STREAK'
+
+    def progress(self, challenge, current, event):
+        return max(current, event.streak)
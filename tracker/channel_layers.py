@@ -0,0 +1,76 @@
+# tracker/channel_layers.py
+
+from collections import defaultdict
+from channels_redis.core import RedisChannelLayer
+
+class LocalFanoutChannelLayer(RedisChannelLayer):
+    """Redis channel layer that delivers group messages once per process, not once per socket.
+
+    Process-local channels (our WebSocket consumers) are kept in an in-memory group map.
+    Redis only learns about one "fanout" channel per process and group, so group_send
+    writes one message per Daphne process and each process copies it to its own sockets.
+    Channels from other processes, and non-local channels, go through Redis as usual.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local_groups = defaultdict(dict) # group -> process-local channel names (dict as an ordered set)
+        self._fanout_prefix = f"specific.{self.client_prefix}!fanout."
+
+    def _is_local(self, channel):
+        return "!" in channel and self.non_local_name(channel).endswith(self.client_prefix + "!")
+
+    def _fanout_channel(self, group):
+        return self._fanout_prefix + group
+
+    ### Groups extension ###
+
+    async def group_add(self, group, channel):
+        if not self._is_local(channel):
+            await super().group_add(group, channel)
+            return
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self._local_groups[group][channel] = None
+        # Re-adding refreshes the group expiry in Redis, so keep doing it on every join
+        await super().group_add(group, self._fanout_channel(group))
+
+    async def group_discard(self, group, channel):
+        if not self._is_local(channel):
+            await super().group_discard(group, channel)
+            return
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        members = self._local_groups.get(group)
+        if members is None:
+            return
+        members.pop(channel, None)
+        if not members:
+            # Last local socket left; stop Redis sending this process the group's messages
+            del self._local_groups[group]
+            await super().group_discard(group, self._fanout_channel(group))
+
+    ### Receiving ###
+
+    async def receive_single(self, channel):
+        """Receives one message and swaps any fanout channel for the group's local channels."""
+        message_channel, message = await super().receive_single(channel)
+        if "!" not in channel:
+            return message_channel, message
+        if not isinstance(message_channel, list):
+            message_channel = [message_channel]
+        targets = []
+        for name in message_channel:
+            if name.startswith(self._fanout_prefix):
+                targets.extend(self._local_groups.get(name[len(self._fanout_prefix):], ()))
+            else:
+                targets.append(name)
+        # receive() buffers the message for each target; an empty list just means every
+        # local member left the group before the message arrived
+        return targets, message
+
+    ### Flush extension ###
+
+    async def flush(self):
+        self._local_groups.clear()
+        await super().flush()
@@ -0,0 +1,120 @@
+# tracker/completion_bits.py
+
+import hashlib
+from collections import defaultdict
+from .catalog import get_catalog
+from .models import Completion, LearnerStats
+
+# Each user's completed lessons are mirrored into LearnerStats.completion_bits: bit n is set
+# when the lesson at catalog position n is complete, stored as little-endian bytes (13
+# bytes for 100 lessons). Membership, per-section counts and "whole course done" are then
+# integer operations on a column of a row hot paths read anyway, instead of fetching the
+# user's Completion rows into a set.
+#
+# Positions move when lessons are added, removed or reordered, so the row also records
+# the catalog layout its bits were built for. Bits built for another layout (or never
+# built) are rebuilt from Completion on the next read or write.
+
+def encode_bits(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+def decode_bits(data):
+    return int.from_bytes(bytes(data or b''), 'little')
+
+def bits_for(catalog, lesson_ids):
+    """The bits of lesson_ids in catalog; lessons it doesn't have are left out."""
+    bits = 0
+    for lesson_id in lesson_ids:
+        lesson = catalog.lesson(lesson_id)
+        if lesson is not None:
+            bits |= 1 << lesson.position
+    return bits
+
+class CompletionBitmap:
+    """A user's completed lessons as bits over the catalog's lesson positions.
+
+    Supports `lesson_id in bitmap`, so it stands in for a set of completed lesson ids,
+    in templates as well.
+    """
+
+    def __init__(self, catalog, bits):
+        self.catalog = catalog
+        self.bits = bits & catalog.course_mask
+
+    def __contains__(self, lesson_id):
+        lesson = self.catalog.lesson(lesson_id)
+        return lesson is not None and bool(self.bits >> lesson.position & 1)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def completed_in_section(self, section_id):
+        return (self.bits & self.catalog.section_masks.get(section_id, 0)).bit_count()
+
+    def section_counts(self):
+        """{section id: lessons completed there}, leaving out sections without a completion."""
+        counts = {section_id: (self.bits & mask).bit_count() for section_id, mask in self.catalog.section_masks.items()}
+        return {section_id: count for section_id, count in counts.items() if count}
+
+    @property
+    def fingerprint(self):
+        """Short digest of the bits: changes whenever a lesson is completed or uncompleted,
+        so it versions anything rendered from them (with the catalog version)."""
+        return hashlib.blake2b(encode_bits(self.bits), digest_size=8).hexdigest()
+
+    def course_completed(self):
+        """Whether every lesson in the course is complete."""
+        return self.catalog.lesson_count > 0 and self.bits == self.catalog.course_mask
+
+def get_completion_bitmap(learner_stats):
+    """The CompletionBitmap stored on a LearnerStats row, rebuilt from Completion (and
+    stored again) if it was built for another catalog layout."""
+    catalog = get_catalog()
+    if learner_stats.completion_layout == catalog.layout:
+        return CompletionBitmap(catalog, decode_bits(learner_stats.completion_bits))
+    bits = bits_for(catalog, Completion.objects.filter(user_id=learner_stats.user_id).values_list('lesson_id', flat=True))
+    # Only if no completion stored fresh bits meanwhile; those include ours and more
+    LearnerStats.objects.filter(user_id=learner_stats.user_id, completion_layout=learner_stats.completion_layout).update(
+        completion_bits=encode_bits(bits), completion_layout=catalog.layout,
+    )
+    return CompletionBitmap(catalog, bits)
+
+def completion_bitmaps(learner_stats_rows):
+    """{user id: CompletionBitmap} for a batch of LearnerStats rows, for bulk reads.
+
+    Bits built for another layout are rebuilt from one Completion query for all such
+    users, but not stored: that is left to get_completion_bitmap or the next completion.
+    """
+    catalog = get_catalog()
+    bitmaps = {row.user_id: CompletionBitmap(catalog, decode_bits(row.completion_bits))
+               for row in learner_stats_rows if row.completion_layout == catalog.layout}
+    stale = [row.user_id for row in learner_stats_rows if row.user_id not in bitmaps]
+    if stale:
+        completed = defaultdict(list)
+        for user_id, lesson_id in Completion.objects.filter(user_id__in=stale).values_list('user_id', 'lesson_id'):
+            completed[user_id].append(lesson_id)
+        for user_id in stale:
+            bitmaps[user_id] = CompletionBitmap(catalog, bits_for(catalog, completed[user_id]))
+    return bitmaps
+
+def apply_completion_bits(user, lessons, step):
+    """Sets (step 1) or clears (step -1) the bits of lessons in the user's bitmap.
+
+    Call after an UPDATE of the user's LearnerStats row in the same transaction: that
+    UPDATE holds the row, so reading the bits and writing them back can't lose a
+    concurrent change. Bits built for another layout are rebuilt from Completion, which
+    already includes this change.
+    """
+    catalog = get_catalog()
+    rows = LearnerStats.objects.filter(user_id=user.id)
+    current = rows.values_list('completion_bits', 'completion_layout').first()
+    if current is None:
+        return
+    data, layout = current
+    if layout == catalog.layout:
+        bits = decode_bits(data)
+        mask = bits_for(catalog, [lesson.id for lesson in lessons])
+        bits = bits | mask if step > 0 else bits & ~mask
+    else:
+        bits = bits_for(catalog, Completion.objects.filter(user_id=user.id).values_list('lesson_id', flat=True))
+    rows.update(completion_bits=encode_bits(bits), completion_layout=catalog.layout)
@@ -1,8 +1,9 @@
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .live_stats import StatsWindow, build_stats_change, next_sequence, replay_buffer
 
 class StatsConsumer(AsyncWebsocketConsumer):
     GROUP_NAME = "live_stats"
@@ -10,13 +11,17 @@ class StatsConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Check if user is authenticated
         if self.scope["user"].is_authenticated:
+            # Nothing is sent until the client subscribes to a window (see receive)
+            self.window = None
+            self.stats_seq = 0 # Last group sequence number folded into self.window
+            self.sent_seq = 0 # Last sequence number sent to the client
+            # A reconnecting client passes ?since=<seq> to catch up instead of reloading
+            self.resume_since = self._get_since()
             await self.channel_layer.group_add(
                 self.GROUP_NAME,
                 self.channel_name
             )
             await self.accept()
-            # Send initial full list of stats upon connection
-            await self.send_all_stats()
         else:
             # Reject unauthenticated connections
             await self.close()
@@ -28,60 +33,115 @@ class StatsConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    # Receive message from WebSocket (optional, we might not need client-to-server messages for this feature)
+    # Receive message from WebSocket
     async def receive(self, text_data):
-        # Example: text_data_json = json.loads(text_data)
-        # message = text_data_json['message']
-        # We likely don't need to handle incoming messages for just broadcasting stats
-        pass
+        try:
+            text_data_json = json.loads(text_data)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(text_data_json, dict):
+            return
+
+        if 'view' in text_data_json:
+            # Subscribe, e.g. {"view": "top", "limit": 5} or {"view": "around_me", "radius": 3}
+            # A resuming client also sends the window it holds as "stats"
+            window = StatsWindow.from_subscription(text_data_json, self.scope["user"].id)
+            if window is not None:
+                self.window = window
+                since, self.resume_since = self.resume_since, None
+                if since is not None and window.seed(text_data_json.get('stats')):
+                    await self.resume_from(since)
+                else:
+                    await self.send_all_stats()
+        elif text_data_json.get('action') == 'resync' and self.window is not None:
+            # Client spotted a gap in the sequence numbers and wants a fresh copy
+            await self.send_all_stats()
 
     # Receive message from the channel group (called when group_send is used)
-    async def stats_update(self, event):
-        stats_data = event['stats_data']
+    async def stats_delta(self, event):
+        # Keep it for clients that reconnect and need to catch up
+        replay_buffer.record(event['seq'], event['changes'])
+        await self.forward_delta(event['seq'], event['changes'])
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'stats_update',
-            'stats': stats_data
-        }))
+    async def forward_delta(self, seq, changes):
+        """Folds one event into the window and sends the client whatever it needs."""
+        if self.window is None or seq <= self.stats_seq:
+            return # Not subscribed yet, or already part of the window we loaded
+        if seq != self.stats_seq + 1:
+            # Missed a group message (or two processes published out of order); reload
+            await self.send_all_stats()
+            return
+        self.stats_seq = seq
 
-    @database_sync_to_async
-    def _get_all_user_stats(self):
-        """Fetches username and total_points for all active users."""
-        profiles = UserProfile.objects.select_related('user').filter(user__is_active=True).order_by('-total_points')
-        stats_list = [
-            {"username": profile.user.username, "points": profile.total_points}
-            for profile in profiles
-        ]
-        return stats_list
+        changes, needs_reload = self.window.apply_changes(changes)
+        if needs_reload:
+            await self.send_all_stats()
+        elif changes:
+            # Send only the changes that touch this client's window. prev_seq lets the
+            # client check that it hasn't missed anything we sent before.
+            await self.send(text_data=json.dumps({
+                'type': 'stats_delta',
+                'seq': seq,
+                'prev_seq': self.sent_seq,
+                'changes': changes,
+            }))
+            self.sent_seq = seq
+
+    async def resume_from(self, since):
+        """Replays the events a reconnecting client missed, or sends a full load if we can't."""
+        events = replay_buffer.events_since(since)
+        if events is None:
+            await self.send_all_stats()
+            return
+        self.stats_seq = self.sent_seq = since
+        for seq, changes in events:
+            await self.forward_delta(seq, changes)
+
+    def _get_since(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(query["since"][0])
+        except (KeyError, ValueError):
+            return None
 
     async def send_all_stats(self):
-        """Sends the current stats of all users to this specific client."""
-        all_stats = await self._get_all_user_stats()
-        await self.send(text_data=json.dumps({
-            'type': 'full_stats_load', # Different type for initial load
-            'stats': all_stats
-        }))
+        """Sends the subscribed window of the leaderboard to this specific client."""
+        # The message comes back already encoded (top windows share one copy per process)
+        seq, message = await database_sync_to_async(self.window.load)()
+        self.stats_seq = self.sent_seq = seq
+        await self.send(text_data=message)
 
 # Helper function to trigger broadcast from outside the consumer (e.g., from a view or signal)
-async def broadcast_stats_update():
+async def broadcast_stats_update(previous_points_by_user, merged=1):
+    """Broadcasts one stats_delta covering the given users instead of re-sending the whole table.
+
+    previous_points_by_user maps user_id -> points before the change; merged is how many
+    profile updates were folded into this message (see live_stats.BroadcastScheduler).
+    """
     from channels.layers import get_channel_layer
     channel_layer = get_channel_layer()
 
     @database_sync_to_async
-    def _get_stats():
-        profiles = UserProfile.objects.select_related('user').filter(user__is_active=True).order_by('-total_points')
-        return [
-            {"username": profile.user.username, "points": profile.total_points}
-            for profile in profiles
-        ]
+    def _get_changes():
+        changes = []
+        for user_id, previous_points in previous_points_by_user.items():
+            change = build_stats_change(user_id, previous_points)
+            if change is not None:
+                changes.append(change)
+        if not changes:
+            return None, changes
+        return next_sequence(), changes
 
-    latest_stats = await _get_stats()
+    seq, changes = await _get_changes()
+    if not changes:
+        return
 
     await channel_layer.group_send(
         StatsConsumer.GROUP_NAME,
         {
-            'type': 'stats_update', # This corresponds to the method name in the consumer
-            'stats_data': latest_stats
+            'type': 'stats_delta', # This corresponds to the method name in the consumer
+            'seq': seq,
+            'changes': changes,
+            'merged': merged,
         }
-    ) 
\ No newline at end of file
+    )
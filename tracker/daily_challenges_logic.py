@@ -1,108 +1,125 @@
 # tracker/daily_challenges_logic.py
 
+import hashlib
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 from django.contrib import messages
-from .models import User, DailyChallenge, UserDailyChallenge, UserProfile, Completion, Lesson
-import random
+from .models import DailyChallenge, DailyChallengeHistory, UserDailyChallenge
+from .challenge_types import get_challenge_type
+from .learner_stats import record_challenge_completion, record_daily_points
+from .scoring import add_points
 
-def assign_new_daily_challenge(user):
-    """Assigns a new random daily challenge if the user doesn't have one for today or it's the first time."""
-    today = timezone.now().date()
-    user_challenge_instance, created = UserDailyChallenge.objects.get_or_create(
-        user=user,
-        defaults={'assigned_date': today}
-    )
+ACTIVE_CHALLENGES_CACHE_KEY = 'daily_challenges:active'
+ACTIVE_CHALLENGES_CACHE_TIMEOUT = 60 * 60
 
-    # Assign new challenge ONLY if it was just created for the user OR if the current assignment is from a previous day
-    if created or user_challenge_instance.assigned_date < today:
-        active_challenges = DailyChallenge.objects.filter(is_active=True)
-        if not active_challenges.exists():
-            user_challenge_instance.challenge = None # No active challenge types available
-            user_challenge_instance.current_progress = 0
-            user_challenge_instance.initial_points_at_assignment = 0
-            user_challenge_instance.completed_date = None
-            user_challenge_instance.assigned_date = today # Update to today if it was an old one
-            user_challenge_instance.save()
-            return user_challenge_instance # Return the instance, even if no challenge assigned
+def active_challenges():
+    """Active DailyChallenge rows ordered by id, cached until a DailyChallenge changes."""
+    challenges = cache.get(ACTIVE_CHALLENGES_CACHE_KEY)
+    if challenges is None:
+        challenges = list(DailyChallenge.objects.filter(is_active=True).select_related('section').order_by('id'))
+        cache.set(ACTIVE_CHALLENGES_CACHE_KEY, challenges, ACTIVE_CHALLENGES_CACHE_TIMEOUT)
+    return challenges
 
-        selected_challenge = random.choice(list(active_challenges))
-        
-        user_challenge_instance.challenge = selected_challenge
-        user_challenge_instance.assigned_date = today
-        user_challenge_instance.completed_date = None # Reset completion status
-        user_challenge_instance.current_progress = 0 # Reset progress
-        
-        if selected_challenge.challenge_type == 'EARN_N_POINTS':
-            try:
-                profile = UserProfile.objects.get(user=user)
-                user_challenge_instance.initial_points_at_assignment = profile.total_points
-            except UserProfile.DoesNotExist:
-                 user_challenge_instance.initial_points_at_assignment = 0 # Should not happen
-        else:
-            user_challenge_instance.initial_points_at_assignment = None
-            
-        user_challenge_instance.save()
-    
-    # Always return the instance for the current user (which might be from today, completed or not)
-    return user_challenge_instance
+def forget_active_challenges():
+    cache.delete(ACTIVE_CHALLENGES_CACHE_KEY)
+
+def select_daily_challenge(user_id, day, challenges=None):
+    """The user's challenge for day: a pick from the active challenges seeded by a hash of
+    (user id, day), so every process computes the same one without storing it first.
+    None if no challenge is active."""
+    challenges = active_challenges() if challenges is None else challenges
+    if not challenges:
+        return None
+    digest = hashlib.blake2b(f'{user_id}:{day.isoformat()}'.encode(), digest_size=8).digest()
+    return challenges[int.from_bytes(digest, 'big') % len(challenges)]
+
+def roll_over(user_challenge_instance, day, challenge):
+    """Points the instance at day's challenge with no progress yet (doesn't save)."""
+    user_challenge_instance.challenge = challenge
+    user_challenge_instance.assigned_date = day
+    user_challenge_instance.completed_date = None
+    user_challenge_instance.current_progress = 0
+    # Progress comes from completion events (see challenge_types.py), not a points baseline
+    user_challenge_instance.initial_points_at_assignment = None
 
-def update_daily_challenge_progress(user, request=None, completed_lesson_info=None, points_earned_in_action=0):
-    """Updates the user's active daily challenge progress and awards if completed (only once)."""
+def archive_daily_challenges(rows):
+    """Appends the days that rows (UserDailyChallenge instances about to roll over) held to
+    DailyChallengeHistory, in one INSERT. Rows without a challenge are skipped, and a day
+    that is already archived is left as it is."""
+    DailyChallengeHistory.objects.bulk_create([
+        DailyChallengeHistory(user_id=row.user_id, day=row.assigned_date, challenge_id=row.challenge_id,
+                              progress=max(0, row.current_progress), completed=row.completed_date is not None)
+        for row in rows if row.challenge_id is not None
+    ], ignore_conflicts=True)
+
+def challenges_completed_since(user, day):
+    """How many daily challenges the user completed from day up to today, from the
+    (user, day) index on the archive plus the current row."""
+    count = DailyChallengeHistory.objects.filter(user=user, day__gte=day, completed=True).count()
+    return count + UserDailyChallenge.objects.filter(user=user, completed_date__gte=day).count()
+
+def todays_daily_challenge(user, user_challenge_instance):
+    """Returns the user's UserDailyChallenge for today from their stored row (None if they
+    have none), as loaded by a LearnerState, without writing anything.
+
+    A row from an earlier day (or a missing row) is rolled over to today's challenge in
+    memory only; the first progress update, or the assign_daily_challenges job, stores it.
+    """
     today = timezone.now().date()
-    # Retrieve the challenge instance assigned for today or create if missing (should be handled by assign_new)
-    user_challenge_instance = UserDailyChallenge.objects.filter(user=user, assigned_date=today).first()
+    if user_challenge_instance is None:
+        user_challenge_instance = UserDailyChallenge(user=user)
+    elif user_challenge_instance.assigned_date >= today:
+        return user_challenge_instance
+    roll_over(user_challenge_instance, today, select_daily_challenge(user.id, today))
+    return user_challenge_instance
 
-    # Only proceed if there is an instance assigned for today and it has a challenge and it's not already marked completed
-    if not user_challenge_instance or not user_challenge_instance.challenge or user_challenge_instance.is_completed:
-        return 
+def update_daily_challenge_progress(user, events, request=None):
+    """Feeds CompletionEvents (in the order they happened) to the user's daily challenge and
+    awards it if completed (only once).
 
-    challenge = user_challenge_instance.challenge
-    updated = False
+    Call after the transaction that earned the progress has committed: this runs in a
+    short transaction of its own. Progress comes from the challenge type's evaluator and
+    the events alone, so an update is one locking read of the user's row and one write
+    however many events there are, plus atomic increments for the bonus when it
+    completes. Returns True if the challenge was completed by this update.
+    """
+    today = timezone.now().date()
+    with transaction.atomic():
+        user_challenge_instance = (UserDailyChallenge.objects.select_for_update(of=('self',))
+                                   .select_related('challenge').filter(user=user).first())
+        rolled_over = user_challenge_instance is None or user_challenge_instance.assigned_date < today
+        if rolled_over:
+            # First progress today; store the rollover that dashboard loads only computed
+            if user_challenge_instance is None:
+                user_challenge_instance = UserDailyChallenge(user=user)
+            else:
+                archive_daily_challenges([user_challenge_instance])
+            roll_over(user_challenge_instance, today, select_daily_challenge(user.id, today))
 
-    if challenge.challenge_type == 'COMPLETE_N_LESSONS':
-        if completed_lesson_info: # This means a lesson was just completed
-            user_challenge_instance.current_progress += 1
-            updated = True
-    elif challenge.challenge_type == 'EARN_N_POINTS':
-        try:
-            profile = UserProfile.objects.get(user=user)
-            points_progress = profile.total_points - (user_challenge_instance.initial_points_at_assignment or 0)
-            # Only update progress if it actually increased (handles potential point loss scenarios better)
-            if points_progress > user_challenge_instance.current_progress:
-                 user_challenge_instance.current_progress = max(0, points_progress)
-                 updated = True
-            elif user_challenge_instance.current_progress == 0 and points_progress == 0 and points_earned_in_action > 0:
-                 # Edge case: If initial points was 0, and current is 0, but points were earned, update.
-                 user_challenge_instance.current_progress = max(0, points_progress)
-                 updated = True
-        except UserProfile.DoesNotExist:
-            return 
+        challenge = user_challenge_instance.challenge
+        challenge_type = get_challenge_type(challenge.challenge_type) if challenge else None
+        if challenge_type is None or user_challenge_instance.is_completed:
+            if rolled_over:
+                user_challenge_instance.save()
+            return False
 
-    elif challenge.challenge_type == 'COMPLETE_PROJECT':
-        if completed_lesson_info and completed_lesson_info.get('lesson_type') == 'Project':
-            # For this simple version, any project completion counts. We don't track N projects yet.
-            user_challenge_instance.current_progress = 1 # Mark as 1 (representing 1 project done)
-            updated = True
-    
-    if updated:
+        for event in events:
+            user_challenge_instance.current_progress = challenge_type.progress(challenge, user_challenge_instance.current_progress, event)
+            if user_challenge_instance.current_progress >= challenge.target_value:
+                break
+        newly_completed = user_challenge_instance.current_progress >= challenge.target_value
+        if newly_completed:
+            user_challenge_instance.completed_date = today
         user_challenge_instance.save()
 
-    # Check for completion - Award points ONLY if newly completed
-    if user_challenge_instance.current_progress >= challenge.target_value and user_challenge_instance.completed_date is None:
-        user_challenge_instance.completed_date = today
-        user_challenge_instance.save() # Save completion date first
-        
-        # Award points for challenge completion (now happens only once)
-        try:
-            profile = UserProfile.objects.get(user=user)
-            profile.total_points += challenge.points_reward
-            profile.save()
-            if request:
-                messages.success(request, 
-                    f"🏆 Daily Challenge Completed: {challenge.title}! (+{challenge.points_reward} bonus points)")
-        except UserProfile.DoesNotExist:
-            pass # Should not happen
-        
-        # Potentially trigger other things, like an achievement for completing X daily challenges
-        # from tracker.achievements import check_and_award_achievements # Avoid circular import by calling directly if needed
-        # check_and_award_achievements(user, request) # Re-check if completing challenge unlocks other achievements 
\ No newline at end of file
+        if newly_completed:
+            # Award points for challenge completion (happens only once)
+            awarded = add_points(user, challenge.points_reward) is not None
+            if awarded:
+                record_daily_points(user, challenge.points_reward)
+            record_challenge_completion(user, today)
+    if newly_completed and awarded and request:
+        messages.success(request,
+            f"🏆 Daily Challenge Completed: {challenge.title}! (+{challenge.points_reward} bonus points)")
+    return newly_completed
@@ -0,0 +1,133 @@
+# tracker/fragment_cache.py
+
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Rendered template fragments, stored under keys built from the versions of everything
+# they show, so an entry is never invalidated: a change makes new keys, and old entries
+# age out. Lookups and misses are counted so the hit rate can be checked in production
+# (`manage.py fragment_cache_stats`).
+
+class FragmentBackend:
+    """Interface for where fragments and the lookup counters are kept."""
+
+    def get(self, key):
+        """The fragment stored under key, or None; counts the lookup."""
+        raise NotImplementedError
+
+    def set(self, key, fragment):
+        """Stores a fragment rendered after a miss; counts the miss."""
+        raise NotImplementedError
+
+    def counts(self):
+        """{'lookups': ..., 'misses': ...} since the counters were last reset."""
+        raise NotImplementedError
+
+    def reset_counts(self):
+        raise NotImplementedError
+
+class InMemoryFragmentBackend(FragmentBackend):
+    """Fragments held in this process, the least recently used dropped past max_entries.
+
+    Each process renders and counts on its own, so use it with a single worker process
+    (or for tests), and RedisFragmentBackend when several processes serve the site.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()
+        self._lookups = self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            self._lookups += 1
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        with self._lock:
+            self._misses += 1
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def counts(self):
+        with self._lock:
+            return {'lookups': self._lookups, 'misses': self._misses}
+
+    def reset_counts(self):
+        with self._lock:
+            self._lookups = self._misses = 0
+
+class RedisFragmentBackend(FragmentBackend):
+    """Fragments in Redis, shared by every process, each expiring timeout seconds after
+    it was stored. The counters are a Redis hash, so they add up across processes; a hit
+    costs one round trip (the read and its count are pipelined)."""
+
+    KEY_PREFIX = 'fragments:'
+    COUNTERS_KEY = 'fragments:counters'
+
+    def __init__(self, url=None, timeout=24 * 60 * 60):
+        import redis
+        self._redis = redis.Redis.from_url(url or settings.FRAGMENT_CACHE_REDIS_URL)
+        self.timeout = timeout
+
+    def get(self, key):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.get(self.KEY_PREFIX + key)
+        pipe.hincrby(self.COUNTERS_KEY, 'lookups', 1)
+        fragment, _ = pipe.execute()
+        return None if fragment is None else fragment.decode()
+
+    def set(self, key, fragment):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self.KEY_PREFIX + key, fragment.encode(), ex=self.timeout)
+        pipe.hincrby(self.COUNTERS_KEY, 'misses', 1)
+        pipe.execute()
+
+    def counts(self):
+        counts = self._redis.hgetall(self.COUNTERS_KEY)
+        return {name: int(counts.get(name.encode(), 0)) for name in ('lookups', 'misses')}
+
+    def reset_counts(self):
+        self._redis.delete(self.COUNTERS_KEY)
+
+class FragmentCache:
+    """Renders a fragment only when its key hasn't been rendered before; wraps a FragmentBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_or_render(self, key, render):
+        """The fragment stored under key, or render()'s result, stored for next time."""
+        fragment = self.backend.get(key)
+        if fragment is None:
+            fragment = render()
+            self.backend.set(key, fragment)
+        return fragment
+
+    def stats(self):
+        """Lookups, hits, misses and the hit rate (None before the first lookup)."""
+        counts = self.backend.counts()
+        lookups, misses = counts['lookups'], counts['misses']
+        hits = max(lookups - misses, 0)
+        return {'lookups': lookups, 'hits': hits, 'misses': misses,
+                'hit_rate': hits / lookups if lookups else None}
+
+_fragment_cache = None
+_fragment_cache_lock = threading.Lock()
+
+def get_fragment_cache():
+    """The process-wide FragmentCache, built on settings.FRAGMENT_CACHE_BACKEND."""
+    global _fragment_cache
+    if _fragment_cache is None:
+        with _fragment_cache_lock:
+            if _fragment_cache is None:
+                _fragment_cache = FragmentCache(import_string(settings.FRAGMENT_CACHE_BACKEND)())
+    return _fragment_cache
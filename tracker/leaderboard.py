@@ -0,0 +1,129 @@
+# tracker/leaderboard.py
+
+from datetime import timedelta
+from django.db.models import BooleanField, Count, ExpressionWrapper, F, Q, Sum, Window
+from django.db.models.functions import Rank
+from django.utils import timezone
+from .models import DailyPoints, LearnerStats
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# window= values besides the all-time board, each summing DailyPoints from its first day
+WINDOWS = ('day', 'week', 'month')
+
+# Columns a board ranks by, best first; user id breaks exact ties so every row has a
+# unique position for keyset pagination. The all-time order matches learnerstats_rank_idx.
+ALL_TIME_SORT_FIELDS = ('total_points', 'lessons_completed', 'achievements_earned')
+WINDOW_SORT_FIELDS = ('total_points', 'lessons_completed')
+
+ENTRY_FIELDS = ('user_id', 'username', 'total_points', 'lessons_completed', 'achievements_earned',
+                'current_streak', 'longest_streak', 'daily_challenge_completed')
+
+def _daily_challenge_completed():
+    return ExpressionWrapper(Q(user__daily_challenge_instance__completed_date__isnull=False),
+                             output_field=BooleanField())
+
+def leaderboard_queryset():
+    """Stats rows of active users; every leaderboard column is already stored on the row."""
+    return LearnerStats.objects.filter(is_active=True).annotate(
+        username=F('user__username'),
+        total_points=F('points'),
+        lessons_completed=F('completion_count'),
+        achievements_earned=F('achievement_count'),
+        daily_challenge_completed=_daily_challenge_completed(),
+    )
+
+def window_start(window, today=None):
+    """First day counted by window: today, this week's Monday, or the 1st of this month."""
+    today = today or timezone.now().date()
+    if window == 'week':
+        return today - timedelta(days=today.weekday())
+    if window == 'month':
+        return today.replace(day=1)
+    return today
+
+def window_queryset(window):
+    """Active users with points in window, summed from the window's DailyPoints rows.
+
+    Points and lessons count the window only; achievements and streaks are the users'
+    current totals from LearnerStats.
+    """
+    return (DailyPoints.objects.filter(day__gte=window_start(window), user__learner_stats__is_active=True)
+            .values('user_id')
+            .annotate(total_points=Sum('points'), lessons_completed=Sum('completion_count'))
+            .filter(total_points__gt=0)
+            .annotate(
+                username=F('user__username'),
+                achievements_earned=F('user__learner_stats__achievement_count'),
+                current_streak=F('user__learner_stats__current_streak'),
+                longest_streak=F('user__learner_stats__longest_streak'),
+                daily_challenge_completed=_daily_challenge_completed(),
+            ))
+
+def encode_cursor(entry, sort_fields):
+    """Cursor pointing just past entry: its sort key and user id."""
+    return '.'.join(str(entry[field]) for field in (*sort_fields, 'user_id'))
+
+def decode_cursor(cursor, sort_fields):
+    """Returns the cursor's sort values followed by its user id, or None if it's malformed."""
+    try:
+        values = tuple(int(part) for part in cursor.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    return values if len(values) == len(sort_fields) + 1 else None
+
+def _after(cursor, sort_fields):
+    # Rows that sort after the cursor: lower on the first column that differs, or tied
+    # on every column with a higher user id
+    *values, user_id = cursor
+    condition = Q(**dict(zip(sort_fields, values)), user_id__gt=user_id)
+    for index, field in enumerate(sort_fields):
+        condition |= Q(**dict(zip(sort_fields[:index], values[:index])), **{f'{field}__lt': values[index]})
+    return condition
+
+def _strictly_ahead_of(entry, sort_fields):
+    condition = Q()
+    for index, field in enumerate(sort_fields):
+        condition |= Q(**{earlier: entry[earlier] for earlier in sort_fields[:index]}, **{f'{field}__gt': entry[field]})
+    return condition
+
+def get_leaderboard_page(after=None, page_size=DEFAULT_PAGE_SIZE, window=None):
+    """Returns (entries, next_cursor) for one page of the leaderboard.
+
+    window is None for all-time points, or one of WINDOWS. All-time rows come from
+    LearnerStats along learnerstats_rank_idx; windowed rows sum the window's DailyPoints.
+    Either way rows are fetched with keyset pagination, so memory per request depends on
+    the page size, not the number of users. RANK() runs in SQL over the page. Later pages
+    also run one aggregate that counts the rows before the page, to turn page ranks into
+    overall ranks.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    if window in WINDOWS:
+        queryset, sort_fields = window_queryset(window), WINDOW_SORT_FIELDS
+    else:
+        queryset, sort_fields = leaderboard_queryset(), ALL_TIME_SORT_FIELDS
+    cursor = decode_cursor(after, sort_fields) if after else None
+    page = queryset.filter(_after(cursor, sort_fields)) if cursor else queryset
+    entries = list(
+        page.annotate(page_rank=Window(Rank(), order_by=[F(field).desc() for field in sort_fields]))
+        .order_by(*(f'-{field}' for field in sort_fields), 'user_id')
+        .values(*ENTRY_FIELDS, 'page_rank')[:page_size + 1]
+    )
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+
+    ahead_of_first = before_page = 0
+    if cursor and entries:
+        counts = queryset.aggregate(
+            ahead_of_first=Count('user_id', filter=_strictly_ahead_of(entries[0], sort_fields)),
+            before_page=Count('user_id', filter=~_after(cursor, sort_fields)),
+        )
+        ahead_of_first, before_page = counts['ahead_of_first'], counts['before_page']
+    for entry in entries:
+        page_rank = entry.pop('page_rank')
+        # Rows tied with the first row may share its rank with rows on the previous page
+        entry['rank'] = ahead_of_first + 1 if page_rank == 1 else before_page + page_rank
+
+    next_cursor = encode_cursor(entries[-1], sort_fields) if has_more else None
+    return entries, next_cursor
@@ -0,0 +1,75 @@
+# tracker/learner_state.py
+
+from functools import cached_property
+from django.contrib.auth.models import User
+from .completion_bits import get_completion_bitmap
+from .daily_challenges_logic import todays_daily_challenge
+from .learner_stats import get_learner_stats
+from .models import UserProfile, UserStreak
+
+# The user's one-to-one rows, read together the first time any of them is needed
+JOINED_ROWS = ('profile', 'streak', 'learner_stats', 'daily_challenge_instance')
+
+class LearnerState:
+    """What a request reads about one learner, each part loaded the first time it's used
+    and kept for the rest of the request.
+
+    The profile, streak, LearnerStats row and stored daily challenge come from one query
+    joining them to the user; a missing row is created (or rebuilt) as the helpers that
+    used to load it one at a time did. Call refresh() after writing any of them, so
+    later reads see the change.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def _rows(self):
+        user = (User.objects.filter(id=self.user.id)
+                .select_related('profile', 'streak', 'learner_stats', 'daily_challenge_instance__challenge__section')
+                .first())
+        return {name: getattr(user, name, None) for name in JOINED_ROWS}
+
+    @cached_property
+    def profile(self):
+        profile = self._rows['profile'] or UserProfile.objects.get_or_create(user=self.user)[0]
+        # Templates read user.profile too (the points in the navbar)
+        self.user.profile = profile
+        return profile
+
+    @cached_property
+    def streak(self):
+        return self._rows['streak'] or UserStreak.objects.get_or_create(user=self.user)[0]
+
+    @cached_property
+    def learner_stats(self):
+        return self._rows['learner_stats'] or get_learner_stats(self.user)
+
+    @cached_property
+    def daily_challenge(self):
+        """Today's UserDailyChallenge, rolled over in memory if the stored one is older."""
+        return todays_daily_challenge(self.user, self._rows['daily_challenge_instance'])
+
+    @cached_property
+    def completed_lessons(self):
+        """The user's CompletionBitmap."""
+        return get_completion_bitmap(self.learner_stats)
+
+    @cached_property
+    def achievements(self):
+        """Every Achievement with the user's `earned` flag and `awarded_at`, in one query."""
+        from .achievements import achievements_with_earned
+        return list(achievements_with_earned(self.user))
+
+    def refresh(self):
+        """Forgets everything loaded so far."""
+        for name in ('_rows', 'profile', 'streak', 'learner_stats', 'daily_challenge', 'completed_lessons', 'achievements'):
+            self.__dict__.pop(name, None)
+        self.user._state.fields_cache.pop('profile', None)
+
+def get_learner_state(request):
+    """The LearnerState of request.user, shared by everything that handles the request."""
+    state = getattr(request, '_learner_state', None)
+    if state is None:
+        state = request._learner_state = LearnerState(request.user)
+    return state
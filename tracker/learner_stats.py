@@ -0,0 +1,241 @@
+# tracker/learner_stats.py
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .catalog import get_catalog
+from .completion_bits import apply_completion_bits, bits_for, encode_bits
+from .models import (LearnerStats, Completion, DailyChallengeHistory, DailyPoints, UserAchievement,
+                     UserDailyChallenge)
+
+# Every column rebuilt from the source tables (and compared when looking for drift)
+STATS_FIELDS = [
+    'points', 'completion_count', 'project_count', 'achievement_count',
+    'current_streak', 'longest_streak', 'last_activity_date', 'is_active',
+    'challenges_completed', 'challenge_streak', 'longest_challenge_streak', 'last_challenge_date',
+]
+
+def get_learner_stats(user):
+    """Returns the user's LearnerStats row (a primary-key lookup), rebuilding it if it's missing."""
+    stats = LearnerStats.objects.filter(user_id=user.id).first()
+    if stats is None:
+        rebuild_learner_stats([user.id])
+        stats = LearnerStats.objects.get(user_id=user.id)
+    return stats
+
+def record_completion(user, lesson):
+    """Counts a new Completion of lesson. Call in the transaction that created it."""
+    record_completions(user, [lesson])
+
+def record_completions(user, lessons):
+    """Counts new Completions of several lessons with one increment per counter. Call in
+    the transaction that created them."""
+    _apply_completion(user, lessons, 1)
+    record_daily_points(user, sum(lesson.points_value for lesson in lessons), completions=len(lessons))
+
+def record_uncompletion(user, lesson, completed_on=None):
+    """Un-counts a deleted Completion of lesson. Call in the transaction that deleted it.
+
+    completed_on is the day the completion was made, so windowed leaderboards take the
+    points back from the day that earned them.
+    """
+    _apply_completion(user, [lesson], -1)
+    record_daily_points(user, -lesson.points_value, completions=-1, day=completed_on)
+
+def _apply_completion(user, lessons, step):
+    projects = sum(1 for lesson in lessons if lesson.lesson_type == 'Project')
+    updated = LearnerStats.objects.filter(user_id=user.id).update(
+        completion_count=F('completion_count') + step * len(lessons),
+        project_count=F('project_count') + step * projects,
+    )
+    if not updated:
+        # The source tables already include this change, so a rebuild covers it
+        rebuild_learner_stats([user.id])
+        return
+    apply_completion_bits(user, lessons, step)
+
+def record_achievement(user, count=1):
+    """Counts newly awarded achievements. Call in the transaction that awarded them."""
+    if not LearnerStats.objects.filter(user_id=user.id).update(achievement_count=F('achievement_count') + count):
+        rebuild_learner_stats([user.id])
+
+def record_challenge_completion(user, day=None):
+    """Counts a daily challenge completed on day (today by default) and extends the
+    challenge streak, in one UPDATE. Call in the transaction that completed it, once per day."""
+    day = day or timezone.now().date()
+    streak = Case(When(last_challenge_date=day - timedelta(days=1), then=F('challenge_streak') + 1),
+                  default=Value(1), output_field=IntegerField())
+    updated = LearnerStats.objects.filter(user_id=user.id).update(
+        challenges_completed=F('challenges_completed') + 1,
+        challenge_streak=streak,
+        longest_challenge_streak=Greatest(F('longest_challenge_streak'), streak),
+        last_challenge_date=day,
+    )
+    if not updated:
+        rebuild_learner_stats([user.id])
+
+def record_daily_points(user, points, completions=0, day=None):
+    """Adds points (and completed lessons) to the user's DailyPoints row for day, today by default."""
+    day = day or timezone.now().date()
+    rows = DailyPoints.objects.filter(user_id=user.id, day=day)
+    changes = {'points': F('points') + points, 'completion_count': F('completion_count') + completions}
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyPoints.objects.create(user_id=user.id, day=day, points=points, completion_count=completions)
+    except IntegrityError:
+        # Another request created the row first
+        rows.update(**changes)
+
+def per_user(values):
+    """CASE expression giving each user their value from {user_id: value}, 0 for anyone else."""
+    return Case(*(When(user_id=user_id, then=Value(value)) for user_id, value in values.items()),
+                default=Value(0), output_field=IntegerField())
+
+def record_achievements_in_bulk(counts, points, day=None):
+    """record_achievement and record_daily_points for many users in a few queries.
+
+    counts and points map user id -> achievements awarded and bonus points. For callers
+    that add the points with one bulk UPDATE on UserProfile, which skips the post_save
+    mirror, so LearnerStats.points is incremented here as well.
+    """
+    if not counts:
+        return
+    LearnerStats.objects.filter(user_id__in=counts).update(
+        achievement_count=F('achievement_count') + per_user(counts),
+        points=F('points') + per_user(points),
+    )
+    points = {user_id: value for user_id, value in points.items() if value}
+    if not points:
+        return
+    day = day or timezone.now().date()
+    rows = DailyPoints.objects.filter(day=day, user_id__in=points)
+    existing = set(rows.values_list('user_id', flat=True))
+    if existing:
+        rows.filter(user_id__in=existing).update(points=F('points') + per_user({user_id: points[user_id] for user_id in existing}))
+    DailyPoints.objects.bulk_create(
+        [DailyPoints(user_id=user_id, day=day, points=value) for user_id, value in points.items() if user_id not in existing],
+        ignore_conflicts=True,
+    )
+
+def reset_learner_stats(user):
+    """Clears the counters after reset_progress deleted the user's completions and achievements.
+
+    Points and streak follow from the profile and streak saves that reset_progress makes.
+    """
+    LearnerStats.objects.filter(user_id=user.id).update(
+        completion_count=0, project_count=0, achievement_count=0,
+        challenges_completed=0, challenge_streak=0, longest_challenge_streak=0, last_challenge_date=None,
+        completion_bits=b'', completion_layout=get_catalog().layout,
+    )
+    DailyPoints.objects.filter(user_id=user.id).delete()
+    DailyChallengeHistory.objects.filter(user_id=user.id).delete()
+
+def compute_learner_stats(user_ids):
+    """Builds fresh (unsaved) LearnerStats for user_ids from the source tables, keyed by user id.
+
+    Runs a fixed number of queries however many users are passed in.
+    """
+    catalog = get_catalog()
+    rows = {}
+    for user in User.objects.filter(id__in=user_ids).select_related('profile', 'streak'):
+        profile = getattr(user, 'profile', None)
+        streak = getattr(user, 'streak', None)
+        rows[user.id] = LearnerStats(
+            user_id=user.id,
+            points=profile.total_points if profile else 0,
+            current_streak=streak.current_streak if streak else 0,
+            longest_streak=streak.longest_streak if streak else 0,
+            last_activity_date=streak.last_activity_date if streak else None,
+            is_active=user.is_active,
+            completion_layout=catalog.layout,
+        )
+
+    completions = (Completion.objects.filter(user_id__in=user_ids).order_by()
+                   .values_list('user_id', 'lesson__lesson_type')
+                   .annotate(total=Count('id')))
+    for user_id, lesson_type, total in completions:
+        row = rows.get(user_id)
+        if row is None:
+            continue
+        row.completion_count += total
+        if lesson_type == 'Project':
+            row.project_count += total
+
+    completed = defaultdict(list)
+    for user_id, lesson_id in Completion.objects.filter(user_id__in=user_ids).values_list('user_id', 'lesson_id'):
+        completed[user_id].append(lesson_id)
+    for user_id, lesson_ids in completed.items():
+        if user_id in rows:
+            rows[user_id].completion_bits = encode_bits(bits_for(catalog, lesson_ids))
+
+    achievements = (UserAchievement.objects.filter(user_id__in=user_ids).order_by()
+                    .values_list('user_id').annotate(total=Count('id')))
+    for user_id, total in achievements:
+        if user_id in rows:
+            rows[user_id].achievement_count = total
+
+    # Completed challenge days: the archive plus the current row, which isn't archived yet
+    challenge_days = defaultdict(set)
+    for user_id, day in DailyChallengeHistory.objects.filter(user_id__in=user_ids, completed=True).values_list('user_id', 'day'):
+        challenge_days[user_id].add(day)
+    for user_id, day in (UserDailyChallenge.objects.filter(user_id__in=user_ids, completed_date__isnull=False)
+                         .values_list('user_id', 'completed_date')):
+        challenge_days[user_id].add(day)
+    for user_id, days in challenge_days.items():
+        if user_id in rows:
+            _apply_challenge_days(rows[user_id], sorted(days))
+    return rows
+
+def _apply_challenge_days(row, days):
+    """Sets row's challenge counters from the sorted days a challenge was completed."""
+    streak = longest = 0
+    previous = None
+    for day in days:
+        streak = streak + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, streak)
+        previous = day
+    row.challenges_completed = len(days)
+    row.challenge_streak = streak
+    row.longest_challenge_streak = longest
+    row.last_challenge_date = previous
+
+def rebuild_learner_stats(user_ids, dry_run=False):
+    """Recomputes LearnerStats for user_ids from the source tables.
+
+    Returns (rows created, users whose rows had drifted, Counter of drifted field names,
+    with 'completion_bits' for completion bitmaps). With dry_run nothing is written. Bitmaps built for an older catalog layout
+    are rebuilt without counting as drift.
+    """
+    fresh = compute_learner_stats(user_ids)
+    existing = LearnerStats.objects.in_bulk(list(fresh))
+    to_create, to_update, to_rebuild_bits, drift = [], [], [], Counter()
+    drifted_users = set()
+    for user_id, row in fresh.items():
+        current = existing.get(user_id)
+        if current is None:
+            to_create.append(row)
+            continue
+        changed = [field for field in STATS_FIELDS if getattr(current, field) != getattr(row, field)]
+        if changed:
+            drift.update(changed)
+            to_update.append(row)
+            drifted_users.add(user_id)
+        if current.completion_layout != row.completion_layout:
+            to_rebuild_bits.append(row)
+        elif bytes(current.completion_bits) != row.completion_bits:
+            drift['completion_bits'] += 1
+            to_rebuild_bits.append(row)
+            drifted_users.add(user_id)
+
+    if not dry_run:
+        with transaction.atomic():
+            LearnerStats.objects.bulk_create(to_create, ignore_conflicts=True)
+            LearnerStats.objects.bulk_update(to_update, STATS_FIELDS)
+            LearnerStats.objects.bulk_update(to_rebuild_bits, ['completion_bits', 'completion_layout'])
+    return len(to_create), len(drifted_users), drift
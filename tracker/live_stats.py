@@ -0,0 +1,394 @@
+# tracker/live_stats.py
+
+import json
+import logging
+import threading
+from collections import deque
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Cache key holding the last sequence number handed out to a live stats broadcast.
+# With a shared cache (Redis) every process draws from the same counter, so clients
+# can spot a missed message by a gap in the numbers.
+SEQUENCE_CACHE_KEY = 'live_stats:seq'
+
+def next_sequence():
+    """Returns the next live stats sequence number (monotonically increasing)."""
+    cache.add(SEQUENCE_CACHE_KEY, 0, timeout=None)
+    try:
+        return cache.incr(SEQUENCE_CACHE_KEY)
+    except ValueError:
+        # Key was evicted between add() and incr(); start again. Clients see the
+        # jump backwards as a gap and reload, which is what we want.
+        cache.add(SEQUENCE_CACHE_KEY, 0, timeout=None)
+        return cache.incr(SEQUENCE_CACHE_KEY)
+
+def current_sequence():
+    """Returns the last sequence number handed out, without advancing it."""
+    return cache.get(SEQUENCE_CACHE_KEY, 0)
+
+def build_stats_change(user_id, previous_points):
+    """Builds the delta entry for one user: new points plus rank movement.
+
+    Runs one lookup for the user and one aggregate for both ranks, so the cost does
+    not depend on how many learners there are. Returns None if the profile is gone.
+    """
+    profile = UserProfile.objects.select_related('user').filter(user_id=user_id).first()
+    if profile is None:
+        return None
+    if not profile.user.is_active:
+        # Deactivated accounts drop off the live standings
+        return {'username': profile.user.username, 'removed': True}
+
+    points = profile.total_points
+    if previous_points is None:
+        previous_points = points
+    ranks = UserProfile.objects.filter(user__is_active=True).exclude(user_id=user_id).aggregate(
+        ahead_now=Count('id', filter=Q(total_points__gt=points)),
+        ahead_before=Count('id', filter=Q(total_points__gt=previous_points)),
+    )
+    return {
+        'username': profile.user.username,
+        'points': points,
+        'previous_points': previous_points,
+        'rank': ranks['ahead_now'] + 1,
+        'previous_rank': ranks['ahead_before'] + 1,
+    }
+
+def ranked_profiles():
+    """Active profiles in leaderboard order (points, then oldest account first)."""
+    return UserProfile.objects.filter(user__is_active=True).order_by('-total_points', 'user_id')
+
+def stats_window(offset, limit):
+    """Returns leaderboard rows offset..offset+limit with competition ranks (ties share a rank).
+
+    One LIMIT/OFFSET query, plus one indexed count when the window doesn't start at the top.
+    """
+    rows = list(ranked_profiles().values_list('user__username', 'total_points')[offset:offset + limit])
+    stats = []
+    for index, (username, points) in enumerate(rows):
+        if index == 0:
+            if offset == 0:
+                rank = 1
+            else:
+                rank = ranked_profiles().filter(total_points__gt=points).count() + 1
+        elif points == rows[index - 1][1]:
+            rank = stats[-1]['rank']
+        else:
+            # Everyone ahead of this row has strictly more points
+            rank = offset + index + 1
+        stats.append({'rank': rank, 'username': username, 'points': points})
+    return stats
+
+def rerank_window(stats, first_rank):
+    """Re-sorts a window by points and recomputes its ranks from first_rank (in place)."""
+    stats.sort(key=lambda entry: -entry['points'])
+    for index, entry in enumerate(stats):
+        if index > 0 and entry['points'] == stats[index - 1]['points']:
+            entry['rank'] = stats[index - 1]['rank']
+        else:
+            entry['rank'] = first_rank + index
+    return stats
+
+class StatsWindow:
+    """The slice of the leaderboard one live stats socket subscribed to.
+
+    'top' is the first `limit` learners; 'around_me' is `radius` learners either side
+    of the subscriber. Only this slice is queried and pushed to the client.
+    """
+
+    DEFAULT_TOP_LIMIT = 5
+    MAX_TOP_LIMIT = 50
+    MAX_RADIUS = 10
+
+    def __init__(self, view, size, user_id):
+        self.view = view
+        self.size = size
+        self.user_id = user_id
+        self.stats = []
+
+    @classmethod
+    def from_subscription(cls, data, user_id):
+        """Builds a window from a client subscribe message, or returns None if it's invalid."""
+        view = data.get('view')
+        try:
+            if view == 'top':
+                limit = int(data.get('limit', cls.DEFAULT_TOP_LIMIT))
+                return cls(view, max(1, min(limit, cls.MAX_TOP_LIMIT)), user_id)
+            if view == 'around_me':
+                radius = max(0, min(int(data.get('radius', 3)), cls.MAX_RADIUS))
+                return cls(view, radius * 2 + 1, user_id)
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def seed(self, stats):
+        """Restores the window a resuming client already holds; returns False if it looks wrong."""
+        if not isinstance(stats, list) or len(stats) > self.size:
+            return False
+        seeded = []
+        for entry in stats:
+            if not isinstance(entry, dict):
+                return False
+            username, points, rank = entry.get('username'), entry.get('points'), entry.get('rank')
+            if not isinstance(username, str) or not isinstance(points, int) or not isinstance(rank, int):
+                return False
+            seeded.append({'rank': rank, 'username': username, 'points': points})
+        self.stats = seeded
+        return True
+
+    def describe(self):
+        """The subscription as sent back to the client."""
+        if self.view == 'top':
+            return {'view': 'top', 'limit': self.size}
+        return {'view': 'around_me', 'radius': self.size // 2}
+
+    def load(self):
+        """Loads the window; returns (sequence number it reflects, encoded full_stats_load message).
+
+        Top windows come from the shared per-process snapshot, so a reconnect storm costs
+        one query per process. around_me windows depend on the user and are queried directly.
+        """
+        if self.view == 'top':
+            snapshot = get_leaderboard_snapshot()
+            # Copy the rows: apply_changes re-ranks them in place
+            self.stats = [dict(entry) for entry in snapshot.stats[:self.size]]
+            return snapshot.seq, snapshot.encoded_top(self.size)
+
+        # Read the sequence first: any delta numbered after it is not in the rows yet
+        seq = current_sequence()
+        offset = 0
+        points = UserProfile.objects.filter(user_id=self.user_id).values_list('total_points', flat=True).first()
+        if points is not None:
+            position = ranked_profiles().filter(
+                Q(total_points__gt=points) | Q(total_points=points, user_id__lt=self.user_id)
+            ).count()
+            offset = max(0, position - self.size // 2)
+        self.stats = stats_window(offset, self.size)
+        return seq, encode_full_stats_load(seq, self.describe(), self.stats)
+
+    def bounds(self):
+        """First and last rank covered by the window."""
+        first = self.stats[0]['rank'] if self.stats else 1
+        if self.view == 'top':
+            # A top window that isn't full yet takes anyone
+            last = self.size if len(self.stats) >= self.size else float('inf')
+        else:
+            last = self.stats[-1]['rank'] if self.stats else first
+        return first, last
+
+    def apply_changes(self, changes):
+        """Applies delta changes to the window.
+
+        Returns (relevant_changes, needs_reload). Changes that can't move anything in the
+        window are dropped; needs_reload is True when the client can't work out the new
+        window on its own (someone left a top window, or an around_me window shifted).
+        """
+        first, last = self.bounds()
+        usernames = {entry['username'] for entry in self.stats}
+        relevant = []
+        for change in changes:
+            inside = change['username'] in usernames
+            if change.get('removed'):
+                if inside:
+                    return relevant, True
+                continue
+            if self.view == 'top':
+                if not inside and change['rank'] > last:
+                    continue
+                if inside and change['rank'] > last:
+                    return relevant, True # We don't know who moves up to fill the gap
+            else:
+                low, high = sorted((change['previous_rank'], change['rank']))
+                if not inside and (high < first or low > last):
+                    continue
+                if not (inside and first <= low and high <= last):
+                    return relevant, True
+            relevant.append(change)
+
+        for change in relevant:
+            self.stats = [entry for entry in self.stats if entry['username'] != change['username']]
+            self.stats.append({'rank': change['rank'], 'username': change['username'], 'points': change['points']})
+        if relevant:
+            rerank_window(self.stats, first)
+            del self.stats[self.size:]
+        return relevant, False
+
+def encode_full_stats_load(seq, subscription, stats):
+    """Encodes a full_stats_load message for the socket."""
+    return json.dumps({'type': 'full_stats_load', 'seq': seq, **subscription, 'stats': stats})
+
+class LeaderboardSnapshot:
+    """The top of the leaderboard as of one sequence number, with encoded messages memoised."""
+
+    def __init__(self, seq, stats):
+        self.seq = seq
+        self.stats = stats
+        self._encoded = {} # limit -> full_stats_load text
+
+    def encoded_top(self, limit):
+        """The full_stats_load text for a top-`limit` window, encoded once per snapshot."""
+        text = self._encoded.get(limit)
+        if text is None:
+            text = encode_full_stats_load(self.seq, {'view': 'top', 'limit': limit}, self.stats[:limit])
+            self._encoded[limit] = text
+        return text
+
+class LeaderboardSnapshotCache:
+    """Per-process holder of the current LeaderboardSnapshot.
+
+    The snapshot is current while its seq matches the live stats sequence. Misses are
+    single-flight: callers that arrive while a refresh is running wait for it and reuse
+    its result instead of running the same query again.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.refreshes = 0
+
+    def get(self):
+        seq = current_sequence()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.seq == seq:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.seq >= seq:
+                return snapshot # Someone refreshed it while we waited
+            # Read the sequence first: any delta numbered after it is not in the rows yet
+            seq = current_sequence()
+            snapshot = LeaderboardSnapshot(seq, stats_window(0, self.size))
+            self._snapshot = snapshot
+            self.refreshes += 1
+        return snapshot
+
+_snapshot_cache = LeaderboardSnapshotCache(StatsWindow.MAX_TOP_LIMIT)
+
+def get_leaderboard_snapshot():
+    """Returns the current leaderboard snapshot for this process, refreshing it if needed."""
+    return _snapshot_cache.get()
+
+class RecentEventBuffer:
+    """Bounded, per-process ring buffer of recent stats_delta events, keyed by sequence number.
+
+    Lets a client that reconnects with ?since=<seq> catch up on what it missed
+    instead of reloading its whole window.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._events = {} # seq -> changes
+        self._order = deque() # seqs in arrival order, oldest first
+
+    def record(self, seq, changes):
+        """Remembers an event; every socket in the process sees it, so repeats are ignored."""
+        with self._lock:
+            if seq in self._events:
+                return
+            self._events[seq] = changes
+            self._order.append(seq)
+            while len(self._order) > self.size:
+                del self._events[self._order.popleft()]
+
+    def events_since(self, since):
+        """Returns [(seq, changes), ...] for every event after since, or None if the buffer
+        no longer reaches back that far (or never saw some of them)."""
+        with self._lock:
+            if not self._events:
+                return None
+            latest = max(self._events)
+            if since > latest:
+                return None
+            events = []
+            for seq in range(since + 1, latest + 1):
+                if seq not in self._events:
+                    return None
+                events.append((seq, self._events[seq]))
+            return events
+
+replay_buffer = RecentEventBuffer(getattr(settings, 'LIVE_STATS_REPLAY_BUFFER', 500))
+
+class BroadcastScheduler:
+    """Merges the profile changes of one window into a single live stats group message.
+
+    A single mark_complete can save a profile several times (lesson points, each
+    achievement, the daily challenge bonus); each save lands here instead of going
+    straight to the channel layer. State is per process.
+    """
+
+    def __init__(self, window):
+        self.window = window # Seconds; 0 sends every change straight away
+        self._lock = threading.Lock()
+        self._pending = {} # user_id -> points before the first change in this window
+        self._pending_count = 0
+        self._timer = None
+        # Running totals, handy when checking how much merging is going on
+        self.messages_sent = 0
+        self.updates_merged = 0
+
+    def schedule(self, user_id, previous_points):
+        """Queues a broadcast for user_id; it goes out with everything else in the window."""
+        if self.window <= 0:
+            self._send({user_id: previous_points}, 1)
+            return
+        with self._lock:
+            # Keep the oldest previous_points so the rank movement covers the whole window
+            self._pending.setdefault(user_id, previous_points)
+            self._pending_count += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Sends whatever is pending right now (also used by the timer)."""
+        with self._lock:
+            pending, count = self._pending, self._pending_count
+            self._pending, self._pending_count = {}, 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if pending:
+            self._send(pending, count)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Live stats broadcast failed")
+        finally:
+            # The timer thread opened its own DB connection; don't leave it dangling
+            connection.close()
+
+    def _send(self, previous_points_by_user, merged):
+        from .consumers import broadcast_stats_update
+        async_to_sync(broadcast_stats_update)(previous_points_by_user, merged)
+        self.messages_sent += 1
+        self.updates_merged += merged
+        logger.debug("Live stats broadcast sent for %d user(s), merged %d update(s)",
+                     len(previous_points_by_user), merged)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_broadcast_scheduler():
+    """Returns this process's BroadcastScheduler, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BroadcastScheduler(getattr(settings, 'LIVE_STATS_BROADCAST_WINDOW', 0.25))
+    return _scheduler
+
+def schedule_stats_broadcast(user_id, previous_points):
+    """Queues a live stats update for user_id (call after the transaction commits)."""
+    get_broadcast_scheduler().schedule(user_id, previous_points)
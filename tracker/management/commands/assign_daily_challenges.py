@@ -0,0 +1,62 @@
+import time
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from tracker.daily_challenges_logic import active_challenges, archive_daily_challenges, select_daily_challenge
+from tracker.models import UserDailyChallenge
+
+class Command(BaseCommand):
+    help = ("Rolls every active user over to today's daily challenge, in chunks, archiving the day "
+            "each row held to the challenge history first. Selection is the same deterministic pick "
+            "dashboards compute, so running this after midnight only stores what they would show; "
+            "users already on today's challenge are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Users rolled over per chunk (and per transaction).")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        today = timezone.now().date()
+        challenges = active_challenges()
+        started = time.perf_counter()
+        checked = updated = created = 0
+        last_id = 0
+        while True:
+            user_ids = list(User.objects.filter(id__gt=last_id, is_active=True).order_by('id')
+                            .values_list('id', flat=True)[:chunk_size])
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            checked += len(user_ids)
+            with transaction.atomic():
+                rows = list(UserDailyChallenge.objects.select_for_update().filter(user_id__in=user_ids)
+                            .only('user', 'challenge', 'assigned_date', 'completed_date', 'current_progress'))
+                assigned = {row.user_id: row.assigned_date for row in rows}
+                archive_daily_challenges(row for row in rows if row.assigned_date < today)
+                new_users = [user_id for user_id in user_ids if user_id not in assigned]
+                # Placeholder rows, rolled over with the rest below
+                UserDailyChallenge.objects.bulk_create([UserDailyChallenge(user_id=user_id) for user_id in new_users],
+                                                       ignore_conflicts=True)
+                # Group users by the challenge they get so each group is one UPDATE; bulk_update
+                # would compile a CASE branch per row and field, which dominates at this size
+                groups = defaultdict(list)
+                for user_id in user_ids:
+                    if user_id in assigned and assigned[user_id] >= today:
+                        continue # Already on today's challenge
+                    groups[select_daily_challenge(user_id, today, challenges)].append(user_id)
+                for challenge, group in groups.items():
+                    # The same fields roll_over() sets
+                    UserDailyChallenge.objects.filter(user_id__in=group).update(
+                        challenge=challenge, assigned_date=today, completed_date=None, current_progress=0,
+                        initial_points_at_assignment=None,
+                    )
+            rolled = sum(len(group) for group in groups.values())
+            created += len(new_users)
+            updated += rolled - len(new_users)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Checked {checked} active users in {elapsed:.1f}s: {updated} rolled over to {today}, "
+                          f"{created} assigned a first challenge, {checked - updated - created} already current.")
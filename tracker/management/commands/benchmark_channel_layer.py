@@ -0,0 +1,83 @@
+import asyncio
+import time
+from django.core.management.base import BaseCommand, CommandError
+from channels_redis.core import RedisChannelLayer
+from tracker.channel_layers import LocalFanoutChannelLayer
+
+class Command(BaseCommand):
+    help = ("Benchmarks LocalFanoutChannelLayer against plain RedisChannelLayer for one global group, "
+            "using an in-process fake Redis (requires the fakeredis package).")
+
+    GROUP = 'benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, nargs='+', default=[1000, 10000, 50000],
+                            help="Connected sockets to simulate, one run per value.")
+        parser.add_argument('--processes', type=int, default=4,
+                            help="Simulated Daphne processes sharing the fake Redis.")
+        parser.add_argument('--messages', type=int, default=5,
+                            help="group_send calls per run.")
+
+    def handle(self, *args, **options):
+        try:
+            from fakeredis import FakeServer
+            from fakeredis.aioredis import FakeConnection
+        except ImportError:
+            raise CommandError("This benchmark needs fakeredis (pip install fakeredis).")
+        from redis.asyncio import ConnectionPool
+
+        def make_pool_factory(server):
+            return lambda index: ConnectionPool(server=server, connection_class=FakeConnection)
+
+        self.stdout.write(f"{'layer':<26}{'sockets':>9}{'send ms/msg':>13}{'deliver ms/msg':>16}{'redis bytes/msg':>17}")
+        for connections in options['connections']:
+            for layer_class in (RedisChannelLayer, LocalFanoutChannelLayer):
+                result = asyncio.run(self._run(layer_class, make_pool_factory(FakeServer()),
+                                               connections, options['processes'], options['messages']))
+                self.stdout.write(
+                    f"{layer_class.__name__:<26}{connections:>9}{result['send_ms']:>13.2f}"
+                    f"{result['deliver_ms']:>16.2f}{result['bytes']:>17,}"
+                )
+
+    async def _run(self, layer_class, pool_factory, connections, processes, messages):
+        layers = []
+        for _ in range(processes):
+            layer = layer_class(hosts=['redis://benchmark'], capacity=max(100, messages))
+            layer.create_pool = pool_factory
+            layers.append(layer)
+
+        channels = {layer: [] for layer in layers}
+        for index in range(connections):
+            layer = layers[index % processes]
+            channel = await layer.new_channel()
+            await layer.group_add(self.GROUP, channel)
+            channels[layer].append(channel)
+
+        # Count what the sender actually writes to Redis
+        sender = layers[0]
+        written = []
+        serialize = sender.serialize
+        def counting_serialize(message):
+            data = serialize(message)
+            written.append(len(data))
+            return data
+        sender.serialize = counting_serialize
+
+        started = time.perf_counter()
+        for seq in range(messages):
+            await sender.group_send(self.GROUP, {'type': 'stats.delta', 'seq': seq, 'changes': []})
+        sent = time.perf_counter()
+
+        for layer in layers:
+            for channel in channels[layer]:
+                for _ in range(messages):
+                    await layer.receive(channel)
+        delivered = time.perf_counter()
+
+        for layer in layers:
+            await layer.flush()
+        return {
+            'send_ms': (sent - started) * 1000 / messages,
+            'deliver_ms': (delivered - sent) * 1000 / messages,
+            'bytes': sum(written) // messages,
+        }
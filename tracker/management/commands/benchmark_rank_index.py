@@ -0,0 +1,51 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from tracker.rank_index import InMemoryRankBackend
+
+class Command(BaseCommand):
+    help = ("Benchmarks InMemoryRankBackend with synthetic learners: rank lookups, range reads "
+            "and point updates. Doesn't touch the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help="Ranked learners to simulate, one run per value.")
+        parser.add_argument('--operations', type=int, default=20000,
+                            help="Timed calls per operation and run.")
+        parser.add_argument('--max-points', type=int, default=5000,
+                            help="Points are drawn uniformly from 0..max-points (lots of ties).")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        self.stdout.write(f"{'users':>9}{'load s':>9}{'rank us':>10}{'p99 us':>9}{'range(50) us':>14}{'update us':>11}{'p99 us':>9}")
+        for users in options['users']:
+            backend = InMemoryRankBackend()
+            started = time.perf_counter()
+            backend.load((user_id, rng.randint(0, options['max_points'])) for user_id in range(1, users + 1))
+            load_s = time.perf_counter() - started
+
+            user_ids = [rng.randint(1, users) for _ in range(options['operations'])]
+            rank_us = self._time_each(lambda user_id: backend.rank(user_id), user_ids)
+            starts = [rng.randint(1, max(1, users - 50)) for _ in range(options['operations'])]
+            range_us = self._time_each(lambda start: backend.range(start, start + 49), starts)
+            updates = [(user_id, rng.randint(0, options['max_points'])) for user_id in user_ids]
+            update_us = self._time_each(lambda change: backend.update(*change), updates)
+
+            self.stdout.write(
+                f"{users:>9}{load_s:>9.2f}{self._mean(rank_us):>10.2f}{self._p99(rank_us):>9.2f}"
+                f"{self._mean(range_us):>14.2f}{self._mean(update_us):>11.2f}{self._p99(update_us):>9.2f}"
+            )
+
+    def _time_each(self, operation, arguments):
+        timings = []
+        for argument in arguments:
+            started = time.perf_counter()
+            operation(argument)
+            timings.append((time.perf_counter() - started) * 1e6)
+        return timings
+
+    def _mean(self, timings):
+        return sum(timings) / len(timings)
+
+    def _p99(self, timings):
+        return sorted(timings)[int(len(timings) * 0.99)]
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tracker.fragment_cache import get_fragment_cache
+
+class Command(BaseCommand):
+    help = ("Reports lookups, hits, misses and the hit rate of the rendered fragment cache "
+            "(the dashboard's section list) since the counters were last reset. With the "
+            "in-memory backend each process counts on its own, so this only sees its own "
+            "(empty) counters; use the Redis backend to count across processes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help="Zero the counters after reporting them.")
+
+    def handle(self, *args, **options):
+        fragment_cache = get_fragment_cache()
+        stats = fragment_cache.stats()
+        hit_rate = "n/a" if stats['hit_rate'] is None else f"{stats['hit_rate']:.1%}"
+        self.stdout.write(f"{settings.FRAGMENT_CACHE_BACKEND}: {stats['lookups']} lookups, {stats['hits']} hits, "
+                          f"{stats['misses']} misses, hit rate {hit_rate}.")
+        if options['reset']:
+            fragment_cache.backend.reset_counts()
+            self.stdout.write("Counters reset.")
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from tracker.learner_stats import rebuild_learner_stats
+
+class Command(BaseCommand):
+    help = ("Recomputes every user's LearnerStats row and completion bitmap from completions, "
+            "achievements, profile and streak, in batches, and reports rows that had drifted from the source "
+            "tables. With --dry-run it only verifies them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Users recomputed per batch.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report drift; don't write anything.")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        checked = created = drifted = 0
+        drift_by_field = {}
+        last_id = 0
+        while True:
+            user_ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            batch_created, batch_drifted, drift = rebuild_learner_stats(user_ids, dry_run=options['dry_run'])
+            checked += len(user_ids)
+            created += batch_created
+            drifted += batch_drifted
+            for field, count in drift.items():
+                drift_by_field[field] = drift_by_field.get(field, 0) + count
+
+        verb = "would be" if options['dry_run'] else "were"
+        self.stdout.write(f"Checked {checked} users: {created} missing rows {verb} created, {drifted} users with drifted rows {verb} fixed.")
+        for field, count in sorted(drift_by_field.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {field}: {count} rows")
+        if not created and not drifted:
+            self.stdout.write(self.style.SUCCESS("LearnerStats, completion bitmaps and section progress match the source tables."))
@@ -0,0 +1,131 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand, CommandError
+
+# Worker processes are spawned and unpickle this module before django.setup() runs in
+# their initializer, so models and tracker modules are imported inside functions.
+
+def _init_worker():
+    import django
+    django.setup()
+
+def _reevaluate_chunk(user_ids, slugs, dry_run):
+    from django.db import connection
+    from tracker.achievements import reevaluate_users
+    try:
+        return reevaluate_users(user_ids, slugs=slugs, dry_run=dry_run)
+    finally:
+        connection.close()
+
+class Command(BaseCommand):
+    help = ("Re-evaluates achievement rules for every user in chunks and awards whatever unlocks, "
+            "e.g. after adding an achievement. Each chunk is one transaction with bulk writes, "
+            "and progress can be checkpointed so an interrupted run resumes where it stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Users evaluated per chunk (and per transaction).")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Worker processes; 1 evaluates in this process.")
+        parser.add_argument('--only', action='append', metavar='SLUG',
+                            help="Only evaluate this achievement slug (repeatable).")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be awarded without writing anything.")
+        parser.add_argument('--checkpoint', metavar='PATH',
+                            help="JSON file recording the last fully processed user id; resumed from if it exists.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore an existing checkpoint and start from the first user.")
+
+    def handle(self, *args, **options):
+        from tracker.achievements import ACHIEVEMENT_RULES, reevaluate_users
+        chunk_size = max(1, options['chunk_size'])
+        workers = max(1, options['workers'])
+        from django.db import connection
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite allows one writer at a time and fails rather than waits when concurrent
+            # transactions both try to write, so workers would only contend
+            self.stderr.write("SQLite serialises writes; running with one worker.")
+            workers = 1
+        dry_run = options['dry_run']
+        slugs = options['only']
+        if slugs:
+            unknown = sorted(set(slugs) - set(ACHIEVEMENT_RULES))
+            if unknown:
+                raise CommandError(f"No achievement rule for: {', '.join(unknown)}")
+            slugs = sorted(set(slugs))
+        self.checkpoint = None if dry_run else options['checkpoint']
+
+        start_after = 0
+        if self.checkpoint and os.path.exists(self.checkpoint) and not options['restart']:
+            with open(self.checkpoint) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved.get('only') != slugs:
+                raise CommandError(f"{self.checkpoint} was written for --only {saved.get('only')}; pass --restart to start over.")
+            start_after = saved['last_user_id']
+            self.stdout.write(f"Resuming after user {start_after}.")
+
+        self.slugs, self.started, self.users_done = slugs, time.perf_counter(), 0
+        self.awarded = Counter()
+        chunks = self._chunks(start_after, chunk_size)
+        if workers == 1:
+            for user_ids in chunks:
+                self._done(user_ids, reevaluate_users(user_ids, slugs=slugs, dry_run=dry_run), user_ids[-1])
+        else:
+            self._run_pool(chunks, workers, dry_run)
+
+        elapsed = time.perf_counter() - self.started
+        verb = "Would award" if dry_run else "Awarded"
+        self.stdout.write(f"Evaluated {self.users_done} users in {elapsed:.1f}s "
+                          f"({self.users_done / elapsed if elapsed else 0:.0f} users/s). "
+                          f"{verb} {sum(self.awarded.values())} achievements.")
+        for slug, count in self.awarded.most_common():
+            self.stdout.write(f"  {slug}: {count}")
+
+    def _chunks(self, start_after, chunk_size):
+        # Keyset-paged, so memory doesn't grow with the user count and no read cursor stays
+        # open while the chunks are written
+        from django.contrib.auth.models import User
+        while True:
+            user_ids = list(User.objects.filter(id__gt=start_after).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not user_ids:
+                return
+            start_after = user_ids[-1]
+            yield user_ids
+
+    def _run_pool(self, chunks, workers, dry_run):
+        # Chunks finish out of order; the checkpoint only advances over the contiguous
+        # prefix of finished chunks so a resume never skips an unfinished one.
+        pending, finished, order = {}, {}, []
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            for user_ids in chunks:
+                order.append(user_ids[-1])
+                pending[pool.submit(_reevaluate_chunk, user_ids, self.slugs, dry_run)] = user_ids
+                if len(pending) >= workers * 2:
+                    self._collect(pending, finished, order, FIRST_COMPLETED)
+            while pending:
+                self._collect(pending, finished, order, FIRST_COMPLETED)
+
+    def _collect(self, pending, finished, order, return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            user_ids = pending.pop(future)
+            finished[user_ids[-1]] = (user_ids, future.result())
+        while order and order[0] in finished:
+            user_ids, awarded = finished.pop(order.pop(0))
+            self._done(user_ids, awarded, user_ids[-1])
+
+    def _done(self, user_ids, awarded, last_user_id):
+        self.users_done += len(user_ids)
+        self.awarded.update(awarded)
+        if self.checkpoint:
+            with open(self.checkpoint, 'w') as checkpoint_file:
+                json.dump({'last_user_id': last_user_id, 'only': self.slugs}, checkpoint_file)
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(f"  up to user {last_user_id}: {self.users_done} users, "
+                          f"{self.users_done / elapsed if elapsed else 0:.0f} users/s, "
+                          f"{sum(self.awarded.values())} awarded")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0010_remove_userprofile_receive_email_notifications'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='total_points',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+    ]
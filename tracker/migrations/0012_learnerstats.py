@@ -0,0 +1,81 @@
+# Generated by Django 5.2 on 2026-10-18 07:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+BACKFILL_BATCH_SIZE = 1000
+
+def backfill_learner_stats(apps, schema_editor):
+    """Creates a LearnerStats row for every existing user, a batch of users at a time."""
+    User = apps.get_model('auth', 'User')
+    LearnerStats = apps.get_model('tracker', 'LearnerStats')
+    Completion = apps.get_model('tracker', 'Completion')
+    UserAchievement = apps.get_model('tracker', 'UserAchievement')
+
+    last_id = 0
+    while True:
+        users = list(User.objects.filter(id__gt=last_id).order_by('id')
+                     .select_related('profile', 'streak')[:BACKFILL_BATCH_SIZE])
+        if not users:
+            break
+        last_id = users[-1].id
+        rows = {}
+        for user in users:
+            profile = getattr(user, 'profile', None)
+            streak = getattr(user, 'streak', None)
+            rows[user.id] = LearnerStats(
+                user_id=user.id,
+                points=profile.total_points if profile else 0,
+                current_streak=streak.current_streak if streak else 0,
+                longest_streak=streak.longest_streak if streak else 0,
+                last_activity_date=streak.last_activity_date if streak else None,
+                is_active=user.is_active,
+                section_completions={},
+            )
+        completions = (Completion.objects.filter(user_id__in=rows).order_by()
+                       .values_list('user_id', 'lesson__section_id', 'lesson__lesson_type')
+                       .annotate(total=Count('id')))
+        for user_id, section_id, lesson_type, total in completions:
+            row = rows[user_id]
+            row.completion_count += total
+            if lesson_type == 'Project':
+                row.project_count += total
+            key = str(section_id)
+            row.section_completions[key] = row.section_completions.get(key, 0) + total
+        achievements = (UserAchievement.objects.filter(user_id__in=rows).order_by()
+                        .values_list('user_id').annotate(total=Count('id')))
+        for user_id, total in achievements:
+            rows[user_id].achievement_count = total
+        LearnerStats.objects.bulk_create(rows.values(), ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tracker', '0011_userprofile_total_points_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LearnerStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='learner_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('points', models.IntegerField(default=0)),
+                ('completion_count', models.IntegerField(default=0)),
+                ('project_count', models.IntegerField(default=0)),
+                ('achievement_count', models.IntegerField(default=0)),
+                ('section_completions', models.JSONField(blank=True, default=dict)),
+                ('current_streak', models.IntegerField(default=0)),
+                ('longest_streak', models.IntegerField(default=0)),
+                ('last_activity_date', models.DateField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('is_active', True)), fields=['-points', '-completion_count', '-achievement_count', 'user'], name='learnerstats_rank_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_learner_stats, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2 on 2026-10-18 07:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+BACKFILL_BATCH_SIZE = 1000
+
+def backfill_daily_points(apps, schema_editor):
+    """Rebuilds each user's per-day points from completions, achievements and completed
+    daily challenges, a batch of users at a time.
+
+    Only the latest daily challenge of each user is stored, so earlier challenge
+    bonuses can't be placed on a day and are left out.
+    """
+    User = apps.get_model('auth', 'User')
+    DailyPoints = apps.get_model('tracker', 'DailyPoints')
+    Completion = apps.get_model('tracker', 'Completion')
+    UserAchievement = apps.get_model('tracker', 'UserAchievement')
+    UserDailyChallenge = apps.get_model('tracker', 'UserDailyChallenge')
+
+    last_id = 0
+    while True:
+        user_ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BACKFILL_BATCH_SIZE])
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        rows = {}
+        def add(user_id, day, points, completions=0):
+            row = rows.get((user_id, day))
+            if row is None:
+                row = rows[(user_id, day)] = DailyPoints(user_id=user_id, day=day)
+            row.points += points or 0
+            row.completion_count += completions
+
+        completions = (Completion.objects.filter(user_id__in=user_ids).order_by()
+                       .annotate(day=TruncDate('completed_at')).values_list('user_id', 'day')
+                       .annotate(points=Sum('lesson__points_value'), total=Count('id')))
+        for user_id, day, points, total in completions:
+            add(user_id, day, points, total)
+        awards = (UserAchievement.objects.filter(user_id__in=user_ids).order_by()
+                  .annotate(day=TruncDate('awarded_at')).values_list('user_id', 'day')
+                  .annotate(points=Sum('achievement__points_reward')))
+        for user_id, day, points in awards:
+            add(user_id, day, points)
+        challenges = (UserDailyChallenge.objects.filter(user_id__in=user_ids, completed_date__isnull=False, challenge__isnull=False)
+                      .values_list('user_id', 'completed_date', 'challenge__points_reward'))
+        for user_id, day, points in challenges:
+            add(user_id, day, points)
+        DailyPoints.objects.bulk_create(rows.values(), ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0012_learnerstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPoints',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('points', models.IntegerField(default=0)),
+                ('completion_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_points', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'user'], name='dailypoints_day_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='dailypoints_user_day_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_points, reverse_code=migrations.RunPython.noop),
+    ]
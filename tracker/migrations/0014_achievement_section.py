@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 07:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Section achievements used to find their section by title on every check; link them once
+SECTION_ACHIEVEMENTS = {
+    'html-foundation-complete': 'HTML Foundations',
+    'css-foundation-complete': 'CSS Foundations',
+    'javascript-basics-complete': 'JavaScript Basics',
+}
+
+def link_section_achievements(apps, schema_editor):
+    Achievement = apps.get_model('tracker', 'Achievement')
+    Section = apps.get_model('tracker', 'Section')
+    for slug, section_title in SECTION_ACHIEVEMENTS.items():
+        section = Section.objects.filter(title__icontains=section_title).order_by('order').first()
+        if section:
+            Achievement.objects.filter(achievement_slug=slug, section__isnull=True).update(section=section)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0013_dailypoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='achievement',
+            name='section',
+            field=models.ForeignKey(blank=True, help_text='For section achievements: the section to complete.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='achievements', to='tracker.section'),
+        ),
+        migrations.RunPython(link_section_achievements, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 08:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+BACKFILL_BATCH_SIZE = 1000
+
+def backfill_section_progress(apps, schema_editor):
+    """Counts each user's completions per section, a batch of users at a time."""
+    User = apps.get_model('auth', 'User')
+    Completion = apps.get_model('tracker', 'Completion')
+    UserSectionProgress = apps.get_model('tracker', 'UserSectionProgress')
+
+    last_id = 0
+    while True:
+        user_ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BACKFILL_BATCH_SIZE])
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        counts = (Completion.objects.filter(user_id__in=user_ids).order_by()
+                  .values_list('user_id', 'lesson__section_id').annotate(total=Count('id')))
+        UserSectionProgress.objects.bulk_create(
+            [UserSectionProgress(user_id=user_id, section_id=section_id, completed_count=total)
+             for user_id, section_id, total in counts],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0014_achievement_section'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSectionProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_count', models.IntegerField(default=0)),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_progress', to='tracker.section')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='section_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'section'), name='usersectionprogress_user_section_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_section_progress, reverse_code=migrations.RunPython.noop),
+        # Replaced by UserSectionProgress
+        migrations.RemoveField(
+            model_name='learnerstats',
+            name='section_completions',
+        ),
+    ]
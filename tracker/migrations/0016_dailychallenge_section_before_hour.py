@@ -0,0 +1,87 @@
+# Generated by Django 5.2 on 2026-10-18 08:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+NEW_DAILY_CHALLENGE_TYPES = [
+    {
+        "title": "HTML Deep Dive",
+        "description_template": "Complete {target_value} lessons from {section} today.",
+        "challenge_type": "COMPLETE_N_LESSONS_FROM_SECTION",
+        "section_title": "HTML Foundations",
+        "target_value": 2,
+        "points_reward": 30,
+    },
+    {
+        "title": "Builder's Day",
+        "description_template": "Complete {target_value} projects today.",
+        "challenge_type": "COMPLETE_PROJECT",
+        "target_value": 2,
+        "points_reward": 100,
+    },
+    {
+        "title": "Early Bird",
+        "description_template": "Earn {target_value} points before {hour} today.",
+        "challenge_type": "EARN_N_POINTS_BEFORE_HOUR",
+        "before_hour": 12,
+        "target_value": 20,
+        "points_reward": 25,
+    },
+    {
+        "title": "Keep the Flame",
+        "description_template": "Complete a lesson today to keep a streak of at least {target_value} days.",
+        "challenge_type": "PRESERVE_STREAK",
+        "target_value": 2,
+        "points_reward": 20,
+    },
+]
+
+def populate_new_daily_challenges(apps, schema_editor):
+    DailyChallenge = apps.get_model('tracker', 'DailyChallenge')
+    Section = apps.get_model('tracker', 'Section')
+    for challenge_data in NEW_DAILY_CHALLENGE_TYPES:
+        challenge_data = dict(challenge_data)
+        section_title = challenge_data.pop('section_title', None)
+        if section_title:
+            section = Section.objects.filter(title__icontains=section_title).order_by('order').first()
+            if section is None:
+                continue # Its section doesn't exist here
+            challenge_data['section'] = section
+        DailyChallenge.objects.get_or_create(title=challenge_data['title'], defaults=challenge_data)
+    forget_cached_challenges()
+
+def remove_new_daily_challenges(apps, schema_editor):
+    DailyChallenge = apps.get_model('tracker', 'DailyChallenge')
+    DailyChallenge.objects.filter(title__in=[data['title'] for data in NEW_DAILY_CHALLENGE_TYPES]).delete()
+    forget_cached_challenges()
+
+def forget_cached_challenges():
+    # Historical models send no post_save, so drop the cached active challenge list here
+    from tracker.daily_challenges_logic import forget_active_challenges
+    forget_active_challenges()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0015_usersectionprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailychallenge',
+            name='before_hour',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='For EARN_N_POINTS_BEFORE_HOUR: points count until this hour (0-23, server time).', null=True),
+        ),
+        migrations.AddField(
+            model_name='dailychallenge',
+            name='section',
+            field=models.ForeignKey(blank=True, help_text='For COMPLETE_N_LESSONS_FROM_SECTION: the section lessons must come from.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_challenges', to='tracker.section'),
+        ),
+        migrations.AlterField(
+            model_name='dailychallenge',
+            name='challenge_type',
+            field=models.CharField(choices=[('COMPLETE_N_LESSONS', 'Complete N Lessons'), ('EARN_N_POINTS', 'Earn N Points'), ('COMPLETE_PROJECT', 'Complete N Projects'), ('COMPLETE_N_LESSONS_FROM_SECTION', 'Complete N Lessons from a Section'), ('EARN_N_POINTS_BEFORE_HOUR', 'Earn N Points before an Hour'), ('PRESERVE_STREAK', 'Keep an N-day Streak')], max_length=50),
+        ),
+        migrations.RunPython(populate_new_daily_challenges, reverse_code=remove_new_daily_challenges),
+    ]
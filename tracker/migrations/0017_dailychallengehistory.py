@@ -0,0 +1,64 @@
+# Generated by Django 5.2 on 2026-10-18 08:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_challenge_counters(apps, schema_editor):
+    """Counts the one completed challenge the current UserDailyChallenge rows can show;
+    earlier days were overwritten before history was kept."""
+    LearnerStats = apps.get_model('tracker', 'LearnerStats')
+    UserDailyChallenge = apps.get_model('tracker', 'UserDailyChallenge')
+    completed = UserDailyChallenge.objects.filter(completed_date__isnull=False)
+    LearnerStats.objects.filter(user_id__in=completed.values('user_id')).update(
+        challenges_completed=1, challenge_streak=1, longest_challenge_streak=1,
+        last_challenge_date=Subquery(completed.filter(user_id=OuterRef('user_id')).values('completed_date')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0016_dailychallenge_section_before_hour'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learnerstats',
+            name='challenge_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='learnerstats',
+            name='challenges_completed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='learnerstats',
+            name='last_challenge_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='learnerstats',
+            name='longest_challenge_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DailyChallengeHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('progress', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('challenge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tracker.dailychallenge')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='challenge_history', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='dailychallengehistory_user_day_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_challenge_counters, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0017_dailychallengehistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learnerstats',
+            name='completion_bits',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='learnerstats',
+            name='completion_layout',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2 on 2026-10-18 09:14
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0018_learnerstats_completion_bits'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='UserSectionProgress',
+        ),
+    ]
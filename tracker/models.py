@@ -1,41 +1,109 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from datetime import date, timedelta
 from django.utils import timezone # For date/time operations
 import random # For selecting random challenges
 from django.db import transaction # Import transaction
 
-# Import necessary for broadcasting
-import asyncio
-from asgiref.sync import async_to_sync
-
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    total_points = models.IntegerField(default=0)
+    total_points = models.IntegerField(default=0, db_index=True) # Indexed for rank counts
 
     def __str__(self):
         return f'{self.user.username} Profile ({self.total_points} points)'
 
+    # Fields the post_save handlers below react to: the live stats broadcast, the rank
+    # index and the LearnerStats mirror only run when one of them changed
+    RANKED_FIELDS = ('total_points',)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the ranked values as loaded, to tell what a save changed (and so the
+        # live stats delta can report rank movement)
+        instance._saved_values = {field: getattr(instance, field) for field in cls.RANKED_FIELDS if field in field_names}
+        return instance
+
+    def save(self, *args, **kwargs):
+        saved = getattr(self, '_saved_values', None)
+        if self._state.adding or saved is None:
+            changed = set(self.RANKED_FIELDS)
+        else:
+            changed = {field for field in self.RANKED_FIELDS if field not in saved or getattr(self, field) != saved[field]}
+        if kwargs.get('update_fields') is not None:
+            changed &= set(kwargs['update_fields'])
+        # Read by the post_save handlers, which run inside super().save()
+        self.changed_fields = changed
+        self._previous_points = saved.get('total_points') if saved else None
+        super().save(*args, **kwargs)
+        # The same instance can be saved several times in one request, so compare the
+        # next save against this one
+        self._saved_values = {field: getattr(self, field) for field in self.RANKED_FIELDS}
+
+def ranked_fields_changed(profile):
+    """Whether the save in progress changed a ranked field; True for saves that bypass
+    UserProfile.save() (e.g. fixtures), which don't track changes."""
+    return bool(getattr(profile, 'changed_fields', UserProfile.RANKED_FIELDS))
+
 # Signal to create or update UserProfile whenever a User instance is saved
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
     if created:
+        from .catalog import get_catalog
+        # No completions yet, so an empty bitmap is already right for the current catalog
+        LearnerStats.objects.create(user=instance, is_active=instance.is_active, completion_layout=get_catalog().layout)
         UserProfile.objects.create(user=instance)
-    instance.profile.save()
-
-# Signal to broadcast stats update whenever a UserProfile is saved
+        return
+    # Logins only save last_login; nothing here depends on it
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'is_active' not in update_fields:
+        return
+    # Keep the leaderboard's is_active mirror in step (e.g. delete_account deactivates);
+    # the profile itself doesn't change, so it isn't saved
+    if LearnerStats.objects.filter(user=instance).exclude(is_active=instance.is_active).update(is_active=instance.is_active):
+        # Joining or leaving the ranking changes the leaderboard like a points change does
+        from .scoring import after_ranking_change
+        after_ranking_change(instance)
+
+# Signal to broadcast stats update whenever a UserProfile's points change
 @receiver(post_save, sender=UserProfile)
-def broadcast_profile_update(sender, instance, **kwargs):
+def broadcast_profile_update(sender, instance, created, **kwargs):
+    if not ranked_fields_changed(instance):
+        return
     # Import the function here, just before use
-    from .consumers import broadcast_stats_update
-    # Define the function to run on commit
+    from .live_stats import schedule_stats_broadcast
+    user_id = instance.user_id
+    # Points before this save (0 for a brand new profile)
+    previous_points = 0 if created else getattr(instance, '_previous_points', None)
+    # Define the function to run on commit; the scheduler merges it with other saves
+    # in the same window so one click sends one group message
     def do_broadcast():
-        async_to_sync(broadcast_stats_update)()
+        schedule_stats_broadcast(user_id, previous_points)
     # Schedule the broadcast to run after the current transaction commits
     transaction.on_commit(do_broadcast)
 
+# Keep the rank index (see rank_index.py) in step with points and account status
+@receiver(post_save, sender=UserProfile)
+def sync_rank_index(sender, instance, **kwargs):
+    if not ranked_fields_changed(instance):
+        return
+    from .rank_index import get_rank_index
+    user_id, points = instance.user_id, instance.total_points
+    # Use the user if it came with the profile; otherwise look it up after commit
+    user = instance.user if sender.user.is_cached(instance) else None
+    def do_sync():
+        is_active = user.is_active if user is not None else User.objects.filter(pk=user_id, is_active=True).exists()
+        get_rank_index().sync_user(user_id, points, is_active)
+    transaction.on_commit(do_sync)
+
+@receiver(post_delete, sender=UserProfile)
+def remove_from_rank_index(sender, instance, **kwargs):
+    from .rank_index import get_rank_index
+    user_id = instance.user_id
+    transaction.on_commit(lambda: get_rank_index().remove_user(user_id))
+
 class Section(models.Model):
     title = models.CharField(max_length=200)
     order = models.IntegerField(unique=True) # Ensure unique ordering
@@ -66,6 +134,26 @@ class Lesson(models.Model):
     def __str__(self):
         return f'{self.section.title} - {self.title}'
 
+# Hot paths read the course from an in-process catalog (see catalog.py); have every process
+# rebuild it when a section or lesson changes. Data migrations save through historical
+# models, which send no post_save, so migrating bumps it as well (and, for the same
+# reason, the achievement catalog version and the cached active challenges, see
+# bump_achievement_catalog and forget_active_challenges below).
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def bump_catalog_version(sender, **kwargs):
+    from .catalog import bump_catalog_version
+    bump_catalog_version()
+
+@receiver(post_migrate)
+def bump_catalog_after_migrate(sender, app_config, **kwargs):
+    if app_config.label == 'tracker':
+        bump_catalog_version(sender)
+        bump_achievement_catalog(sender)
+        forget_active_challenges(sender)
+
 class Completion(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='completions')
     lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='completions')
@@ -121,6 +209,9 @@ class Achievement(models.Model):
     # Criteria for unlocking - this can be simple for now, or more complex later
     # For example, a slug to identify the achievement in code for awarding logic
     achievement_slug = models.SlugField(unique=True, help_text="A unique slug for programmatic checking, e.g., 'completed_html_section'.")
+    # Section whose completion unlocks this achievement, for section rules (see achievements.py)
+    section = models.ForeignKey(Section, on_delete=models.SET_NULL, null=True, blank=True, related_name='achievements',
+                                help_text="For section achievements: the section to complete.")
 
     def __str__(self):
         return self.title
@@ -142,12 +233,28 @@ class UserAchievement(models.Model):
 
 # Note: The logic for awarding achievements will be implemented separately, likely in views or signals.
 
+# Achievement evaluation skips rules a user has settled (see achievements.py); forget that
+# when their awards are deleted or the achievements themselves change
+@receiver(post_delete, sender=UserAchievement)
+def forget_settled_achievements(sender, instance, **kwargs):
+    from .achievements import forget_settled_achievements
+    forget_settled_achievements(instance.user_id)
+
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def bump_achievement_catalog(sender, **kwargs):
+    from .achievements import bump_achievement_catalog
+    bump_achievement_catalog()
+
 class DailyChallenge(models.Model):
+    # Each type has an evaluator in tracker/challenge_types.py
     CHALLENGE_TYPES = (
         ('COMPLETE_N_LESSONS', 'Complete N Lessons'),
         ('EARN_N_POINTS', 'Earn N Points'),
-        ('COMPLETE_PROJECT', 'Complete any Project'),
-        # Add more types later, e.g., 'COMPLETE_LESSON_FROM_SECTION_X'
+        ('COMPLETE_PROJECT', 'Complete N Projects'),
+        ('COMPLETE_N_LESSONS_FROM_SECTION', 'Complete N Lessons from a Section'),
+        ('EARN_N_POINTS_BEFORE_HOUR', 'Earn N Points before an Hour'),
+        ('PRESERVE_STREAK', 'Keep an N-day Streak'),
     )
 
     title = models.CharField(max_length=200)
@@ -157,15 +264,37 @@ class DailyChallenge(models.Model):
     target_value = models.IntegerField(default=1)
     points_reward = models.IntegerField(default=20, help_text="Bonus points for completing the daily challenge.")
     is_active = models.BooleanField(default=True, help_text="Whether this challenge type can be assigned.")
+    section = models.ForeignKey(Section, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_challenges',
+                                help_text="For COMPLETE_N_LESSONS_FROM_SECTION: the section lessons must come from.")
+    before_hour = models.PositiveSmallIntegerField(null=True, blank=True,
+                                                   help_text="For EARN_N_POINTS_BEFORE_HOUR: points count until this hour (0-23, server time).")
     # Cooldown in days (e.g., if a user gets this challenge, they can't get it again for X days)
     # For simplicity, we'll start without a cooldown specific to challenge type, but can be added.
 
     def __str__(self):
         return self.title
 
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if self.challenge_type == 'COMPLETE_N_LESSONS_FROM_SECTION' and self.section_id is None:
+            raise ValidationError({'section': "This challenge type needs a section."})
+        if self.challenge_type == 'EARN_N_POINTS_BEFORE_HOUR' and (self.before_hour is None or self.before_hour > 23):
+            raise ValidationError({'before_hour': "This challenge type needs an hour between 0 and 23."})
+
     def get_description(self):
-        """Returns a formatted description using the target_value."""
-        return self.description_template.format(target_value=self.target_value)
+        """Returns a formatted description using the target_value (and {section} or {hour} where the type uses them)."""
+        return self.description_template.format(
+            target_value=self.target_value,
+            section=self.section.title if self.section_id else '',
+            hour=f'{self.before_hour:02d}:00' if self.before_hour is not None else '',
+        )
+
+# Challenge selection reads a cached list of active challenges (see daily_challenges_logic.py)
+@receiver(post_save, sender=DailyChallenge)
+@receiver(post_delete, sender=DailyChallenge)
+def forget_active_challenges(sender, **kwargs):
+    from .daily_challenges_logic import forget_active_challenges
+    forget_active_challenges()
 
 class UserDailyChallenge(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='daily_challenge_instance')
@@ -189,4 +318,114 @@ class UserDailyChallenge(models.Model):
     def is_active_today(self):
         return self.assigned_date == timezone.now().date() and not self.is_completed
 
-# Note: Logic for assigning and updating challenges will be in a separate module/functions. 
\ No newline at end of file
+# Note: Logic for assigning and updating challenges will be in a separate module/functions. 
+
+class DailyChallengeHistory(models.Model):
+    """One user's daily challenge for one past day, archived when the UserDailyChallenge
+    row rolls over to a new day (see archive_daily_challenges in daily_challenges_logic.py).
+
+    Append-only and kept small: the outcome is a flag rather than a date, since a
+    challenge can only be completed on its own day. Totals and streaks are counted into
+    LearnerStats as challenges complete, so this table is only read for history.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge_history')
+    day = models.DateField()
+    challenge = models.ForeignKey(DailyChallenge, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    progress = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Also the (user, day) index history and "completed this month" queries read;
+            # archiving the same day twice is a conflict and skipped
+            models.UniqueConstraint(fields=['user', 'day'], name='dailychallengehistory_user_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} on {self.day}: {'completed' if self.completed else 'not completed'}"
+
+class LearnerStats(models.Model):
+    """Denormalised per-user totals so hot paths read one row instead of recounting.
+
+    Counters are updated in the same transaction as the change they describe (see
+    tracker/learner_stats.py); points, streak and is_active mirror their source rows.
+    Rebuild from the source tables with `manage.py rebuild_learner_stats`.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='learner_stats')
+    points = models.IntegerField(default=0)
+    completion_count = models.IntegerField(default=0)
+    project_count = models.IntegerField(default=0)
+    achievement_count = models.IntegerField(default=0)
+    current_streak = models.IntegerField(default=0)
+    longest_streak = models.IntegerField(default=0)
+    last_activity_date = models.DateField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    # Daily challenges completed, and the run of consecutive days with one completed up to
+    # last_challenge_date (see record_challenge_completion)
+    challenges_completed = models.IntegerField(default=0)
+    challenge_streak = models.IntegerField(default=0)
+    longest_challenge_streak = models.IntegerField(default=0)
+    last_challenge_date = models.DateField(null=True, blank=True)
+    # Completed lessons as bits over the course catalog's lesson positions, and the catalog
+    # layout they were built for; rebuilt when that differs (see completion_bits.py)
+    completion_bits = models.BinaryField(default=b'')
+    completion_layout = models.CharField(max_length=16, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Leaderboard order; only active users are ranked
+            models.Index(
+                fields=['-points', '-completion_count', '-achievement_count', 'user'],
+                name='learnerstats_rank_idx',
+                condition=models.Q(is_active=True),
+            ),
+        ]
+
+    @property
+    def current_challenge_streak(self):
+        """challenge_streak if it is still alive, i.e. a challenge was completed today or yesterday."""
+        if self.last_challenge_date is None or self.last_challenge_date < timezone.now().date() - timedelta(days=1):
+            return 0
+        return self.challenge_streak
+
+    def __str__(self):
+        return f"{self.user.username} stats ({self.points} points, {self.completion_count} completions)"
+
+# Mirror points and streak into LearnerStats whenever their source rows are saved
+@receiver(post_save, sender=UserProfile)
+def mirror_profile_points(sender, instance, **kwargs):
+    if not ranked_fields_changed(instance):
+        return
+    LearnerStats.objects.filter(user_id=instance.user_id).update(points=instance.total_points)
+
+@receiver(post_save, sender=UserStreak)
+def mirror_user_streak(sender, instance, **kwargs):
+    LearnerStats.objects.filter(user_id=instance.user_id).update(
+        current_streak=instance.current_streak,
+        longest_streak=instance.longest_streak,
+        last_activity_date=instance.last_activity_date,
+    )
+
+class DailyPoints(models.Model):
+    """Points (and lessons) a user earned on one day, for today/week/month leaderboards.
+
+    Incremented alongside every points change (see record_daily_points in
+    tracker/learner_stats.py), so a windowed leaderboard sums a few rows per user
+    instead of every Completion in the window.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_points')
+    day = models.DateField()
+    points = models.IntegerField(default=0)
+    completion_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='dailypoints_user_day_unique'),
+        ]
+        indexes = [
+            # Windowed leaderboards read every row from the window's first day onwards
+            models.Index(fields=['day', 'user'], name='dailypoints_day_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} on {self.day}: {self.points} points"
@@ -0,0 +1,232 @@
+# tracker/rank_index.py
+
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+from sortedcontainers import SortedList
+from .models import UserProfile
+
+# Profiles read per query when (re)loading an index from the database
+LOAD_BATCH_SIZE = 10000
+
+def ranked_points():
+    """Yields (user_id, points) for every active learner, in batches."""
+    last_id = 0
+    while True:
+        batch = list(UserProfile.objects.filter(user__is_active=True, user_id__gt=last_id)
+                     .order_by('user_id').values_list('user_id', 'total_points')[:LOAD_BATCH_SIZE])
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1][0]
+
+class RankBackend:
+    """Interface for a points-ordered index of active learners.
+
+    Ranks are competition ranks ("1224"): one more than the number of learners with
+    strictly more points, matching the live standings. Positions are 1-based places in
+    the ordering, ties broken by the backend.
+    """
+
+    def update(self, user_id, points):
+        """Inserts the user or moves them to their new points."""
+        raise NotImplementedError
+
+    def remove(self, user_id):
+        raise NotImplementedError
+
+    def rank(self, user_id):
+        """The user's rank, or None if they aren't ranked."""
+        raise NotImplementedError
+
+    def count(self):
+        """Number of ranked users."""
+        raise NotImplementedError
+
+    def range(self, start, stop):
+        """(user_id, points, rank) for positions start..stop inclusive."""
+        raise NotImplementedError
+
+    def load(self, entries):
+        """Replaces the whole index with entries, an iterable of (user_id, points)."""
+        raise NotImplementedError
+
+    def is_loaded(self):
+        raise NotImplementedError
+
+class InMemoryRankBackend(RankBackend):
+    """Rank index held in this process: a SortedList of (-points, user_id).
+
+    Updates and lookups are O(log n). Each process only sees the profile saves it makes
+    itself, so use it with a single worker process (or for tests), and RedisRankBackend
+    when several processes serve the site.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = SortedList()
+        self._points = {} # user_id -> points currently in _keys
+        self._loaded = False
+
+    def update(self, user_id, points):
+        with self._lock:
+            old = self._points.get(user_id)
+            if old == points:
+                return
+            if old is not None:
+                self._keys.remove((-old, user_id))
+            self._keys.add((-points, user_id))
+            self._points[user_id] = points
+
+    def remove(self, user_id):
+        with self._lock:
+            old = self._points.pop(user_id, None)
+            if old is not None:
+                self._keys.remove((-old, user_id))
+
+    def _rank_of_points(self, points):
+        # (-points,) sorts before every (-points, user_id), so this counts users with more points
+        return self._keys.bisect_left((-points,)) + 1
+
+    def rank(self, user_id):
+        with self._lock:
+            points = self._points.get(user_id)
+            return None if points is None else self._rank_of_points(points)
+
+    def count(self):
+        return len(self._keys)
+
+    def range(self, start, stop):
+        with self._lock:
+            keys = self._keys[max(start, 1) - 1:max(stop, 0)]
+            return [(user_id, -negated, self._rank_of_points(-negated)) for negated, user_id in keys]
+
+    def load(self, entries):
+        points = dict(entries)
+        keys = SortedList((-value, user_id) for user_id, value in points.items())
+        with self._lock:
+            self._points, self._keys, self._loaded = points, keys, True
+
+    def is_loaded(self):
+        return self._loaded
+
+class RedisRankBackend(RankBackend):
+    """Rank index in a Redis sorted set (ZSET), shared by every process.
+
+    ZADD/ZREM/ZCOUNT/ZREVRANGE are all O(log n). Equal scores are ordered by member in
+    reverse, so positions among tied users differ from InMemoryRankBackend; ranks don't.
+    """
+
+    KEY = 'rank_index:points'
+    LOADED_KEY = 'rank_index:loaded'
+
+    def __init__(self, url=None):
+        import redis
+        self._redis = redis.Redis.from_url(url or settings.RANK_INDEX_REDIS_URL)
+
+    def update(self, user_id, points):
+        self._redis.zadd(self.KEY, {user_id: points})
+
+    def remove(self, user_id):
+        self._redis.zrem(self.KEY, user_id)
+
+    def rank(self, user_id):
+        points = self._redis.zscore(self.KEY, user_id)
+        if points is None:
+            return None
+        return self._redis.zcount(self.KEY, f'({points}', '+inf') + 1
+
+    def count(self):
+        return self._redis.zcard(self.KEY)
+
+    def range(self, start, stop):
+        if stop < max(start, 1):
+            return []
+        entries = self._redis.zrevrange(self.KEY, max(start, 1) - 1, stop - 1, withscores=True)
+        pipe = self._redis.pipeline(transaction=False)
+        for _, points in entries:
+            pipe.zcount(self.KEY, f'({points}', '+inf')
+        ahead = pipe.execute()
+        return [(int(member), int(points), above + 1) for (member, points), above in zip(entries, ahead)]
+
+    def load(self, entries):
+        staging = self.KEY + ':loading'
+        self._redis.delete(staging)
+        batch = {}
+        for user_id, points in entries:
+            batch[user_id] = points
+            if len(batch) >= LOAD_BATCH_SIZE:
+                self._redis.zadd(staging, batch)
+                batch = {}
+        if batch:
+            self._redis.zadd(staging, batch)
+        pipe = self._redis.pipeline()
+        if self._redis.exists(staging):
+            pipe.rename(staging, self.KEY)
+        else:
+            pipe.delete(self.KEY)
+        pipe.set(self.LOADED_KEY, 1)
+        pipe.execute()
+
+    def is_loaded(self):
+        return bool(self._redis.exists(self.LOADED_KEY))
+
+class RankIndex:
+    """Answers "rank of user X" and "users at places a..b" without scanning the table.
+
+    Wraps a RankBackend, loading it from UserProfile on first use. Profile saves keep
+    it current through sync_user(), called from a post_save handler in models.py.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._load_lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self.backend.is_loaded():
+            return
+        with self._load_lock:
+            if not self.backend.is_loaded():
+                self.backend.load(ranked_points())
+
+    def rebuild(self):
+        """Reloads the backend from the database."""
+        with self._load_lock:
+            self.backend.load(ranked_points())
+
+    def sync_user(self, user_id, points, is_active):
+        """Applies one profile change. A backend that isn't loaded yet picks it up when it loads."""
+        if not self.backend.is_loaded():
+            return
+        if is_active:
+            self.backend.update(user_id, points)
+        else:
+            self.backend.remove(user_id)
+
+    def remove_user(self, user_id):
+        if self.backend.is_loaded():
+            self.backend.remove(user_id)
+
+    def rank(self, user_id):
+        self._ensure_loaded()
+        return self.backend.rank(user_id)
+
+    def count(self):
+        self._ensure_loaded()
+        return self.backend.count()
+
+    def range(self, start, stop):
+        self._ensure_loaded()
+        return self.backend.range(start, stop)
+
+_rank_index = None
+_rank_index_lock = threading.Lock()
+
+def get_rank_index():
+    """The process-wide RankIndex, built on settings.RANK_INDEX_BACKEND."""
+    global _rank_index
+    if _rank_index is None:
+        with _rank_index_lock:
+            if _rank_index is None:
+                _rank_index = RankIndex(import_string(settings.RANK_INDEX_BACKEND)())
+    return _rank_index
@@ -0,0 +1,78 @@
+# tracker/scoring.py
+
+from datetime import date, timedelta
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from .models import LearnerStats, UserProfile, UserStreak
+
+# Points and streaks change with one UPDATE each that does the arithmetic in the database
+# (F() expressions and conditional UPDATEs) instead of select_for_update() and save(), so
+# concurrent requests for the same user can't overwrite each other's changes and nothing
+# is locked before it is written. Callers keep these writes in short transactions, after
+# any slow reads, and take row locks in one order to avoid deadlocks: UserProfile, then
+# LearnerStats, then the rest (DailyPoints, UserStreak).
+#
+# QuerySet.update() skips post_save, so the LearnerStats mirror and the after-commit
+# broadcast and rank index sync that UserProfile's signals do are done here.
+
+def add_points(user, points):
+    """Adds points to the user's profile (negative points take them away, stopping at 0)
+    and mirrors the total into LearnerStats. Returns the new total, or None if the user
+    has no profile. DailyPoints are left to the caller, who knows which day they belong to.
+    """
+    total_points = F('total_points') + points
+    if points < 0:
+        total_points = Greatest(total_points, Value(0))
+    profiles = UserProfile.objects.filter(user_id=user.id)
+    if not profiles.update(total_points=total_points):
+        return None
+    # The UPDATE holds the row until commit, so this reads our own total
+    total = profiles.values_list('total_points', flat=True).first()
+    LearnerStats.objects.filter(user_id=user.id).update(points=total)
+    # Off by the clamped amount when a deduction hit 0; only the rank movement uses it
+    after_ranking_change(user, total - points)
+    return total
+
+def after_ranking_change(user, previous_points=None):
+    """After commit, queues the live stats broadcast for the user and brings their rank
+    index entry up to date; for changes made without UserProfile.save(), whose signals
+    would otherwise do it. previous_points is the total before the change, if known."""
+    from .live_stats import schedule_stats_broadcast
+    from .rank_index import get_rank_index
+    user_id, is_active = user.id, user.is_active
+    def after_commit():
+        schedule_stats_broadcast(user_id, previous_points)
+        # Commits for one user can finish their hooks out of order, so index the
+        # committed total rather than the one this transaction saw
+        points = UserProfile.objects.filter(user_id=user_id).values_list('total_points', flat=True).first()
+        if points is not None:
+            get_rank_index().sync_user(user_id, points, is_active)
+    transaction.on_commit(after_commit)
+
+def record_activity(user, day=None):
+    """Counts activity on day (today by default) towards the user's streak and returns the
+    current streak.
+
+    The first activity of a day extends or restarts the streak with one conditional
+    UPDATE (the same rules as UserStreak.update_streak); later ones only read it.
+    """
+    day = day or date.today()
+    streak = Case(When(last_activity_date=day - timedelta(days=1), then=F('current_streak') + 1),
+                  default=Value(1), output_field=IntegerField())
+    streaks = UserStreak.objects.filter(user_id=user.id)
+    extended = streaks.filter(Q(last_activity_date__lt=day) | Q(last_activity_date__isnull=True)).update(
+        current_streak=streak,
+        longest_streak=Greatest(F('longest_streak'), streak),
+        last_activity_date=day,
+    )
+    current = streaks.values_list('current_streak', 'longest_streak').first()
+    if current is None:
+        # Normally created with the profile
+        UserStreak.objects.get_or_create(user=user)
+        return record_activity(user, day)
+    if extended:
+        LearnerStats.objects.filter(user_id=user.id).update(
+            current_streak=current[0], longest_streak=current[1], last_activity_date=day,
+        )
+    return current[0]
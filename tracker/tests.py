@@ -0,0 +1,409 @@
+# tracker/tests.py
+
+import asyncio
+import threading
+from datetime import datetime
+from unittest import mock, skipIf
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from tracker.achievements import (PAGE_VIEWED, check_and_award_achievements, forget_settled_achievements,
+                                  reevaluate_users)
+from tracker.catalog import bump_catalog_version
+from tracker.challenge_types import CHALLENGE_TYPES, CompletionEvent, get_challenge_type
+from tracker.channel_layers import LocalFanoutChannelLayer
+from tracker.fragment_cache import FragmentCache, InMemoryFragmentBackend
+from tracker.models import (Achievement, Completion, DailyChallenge, DailyPoints, LearnerStats, Lesson,
+                            UserAchievement, UserDailyChallenge, UserProfile)
+
+try:
+    from fakeredis import FakeServer
+    from fakeredis.aioredis import FakeConnection
+except ImportError: # Optional, like for benchmark_channel_layer
+    FakeServer = None
+
+# Tests don't need a running Redis: groups and broadcasts stay in the process
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+def writes_to(queries, model):
+    """The INSERT, UPDATE and DELETE statements among queries that touch model's table."""
+    table = model._meta.db_table
+    return [query['sql'] for query in queries.captured_queries
+            if query['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE') and f'"{table}"' in query['sql']]
+
+def supports_concurrent_writes():
+    """Whether threads can write to the test database at the same time and wait for each
+    other's locks. SQLite only waits with a file database and IMMEDIATE transactions; the
+    in-memory test database raises "table is locked" instead."""
+    if connection.vendor != 'sqlite':
+        return True
+    return (not connection.is_in_memory_db()
+            and connection.settings_dict['OPTIONS'].get('transaction_mode') == 'IMMEDIATE')
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConcurrentCompletionTests(TransactionTestCase):
+    """Completions for one user from several threads at once, each in its own connection."""
+
+    THREADS = 4
+    LESSONS_PER_THREAD = 3
+    # The course, achievements and challenges come from data migrations; put them back
+    # after each test flushes the database
+    serialized_rollback = True
+
+    def setUp(self):
+        if not supports_concurrent_writes():
+            self.skipTest("the test database can't take writes from several threads at once")
+        # Broadcasts would go out from the request threads; nothing here listens to them
+        patcher = mock.patch('tracker.live_stats.schedule_stats_broadcast')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('learner', password='pw')
+
+    def complete_concurrently(self, lesson_ids_per_thread):
+        clients = []
+        for _ in lesson_ids_per_thread:
+            client = Client()
+            client.force_login(self.user)
+            clients.append(client)
+        barrier = threading.Barrier(len(clients))
+        errors = []
+
+        def complete(client, lesson_ids):
+            try:
+                barrier.wait()
+                for lesson_id in lesson_ids:
+                    response = client.post(reverse('mark_complete', args=[lesson_id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                    if response.status_code != 200:
+                        errors.append(response.content)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=complete, args=(client, lesson_ids))
+                   for client, lesson_ids in zip(clients, lesson_ids_per_thread)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assertExactTotals(self, lessons):
+        """The profile, its LearnerStats mirror and the DailyPoints rollup add up to exactly
+        what the completed lessons, the awarded achievements and the daily challenge earned."""
+        achievement_points = (Achievement.objects.filter(user_awards__user=self.user)
+                              .aggregate(total=Sum('points_reward'))['total'] or 0)
+        challenge = (UserDailyChallenge.objects.filter(user=self.user, completed_date__isnull=False)
+                     .select_related('challenge').first())
+        expected = (sum(lesson.points_value for lesson in lessons) + achievement_points
+                    + (challenge.challenge.points_reward if challenge else 0))
+
+        profile = UserProfile.objects.get(user=self.user)
+        learner_stats = LearnerStats.objects.get(user=self.user)
+        self.assertEqual(profile.total_points, expected)
+        self.assertEqual(learner_stats.points, expected)
+        self.assertEqual(DailyPoints.objects.filter(user=self.user).aggregate(total=Sum('points'))['total'], expected)
+        self.assertEqual(learner_stats.completion_count, len(lessons))
+        self.assertEqual(learner_stats.project_count, sum(lesson.lesson_type == 'Project' for lesson in lessons))
+        self.assertEqual(learner_stats.achievement_count, UserAchievement.objects.filter(user=self.user).count())
+        self.assertEqual(Completion.objects.filter(user=self.user).count(), len(lessons))
+
+    def test_distinct_lessons_add_up(self):
+        lessons = list(Lesson.objects.order_by('section__order', 'order')[:self.THREADS * self.LESSONS_PER_THREAD])
+        ids = [lesson.id for lesson in lessons]
+        self.complete_concurrently([ids[index::self.THREADS] for index in range(self.THREADS)])
+        self.assertExactTotals(lessons)
+
+    def test_same_lessons_count_once(self):
+        lessons = list(Lesson.objects.order_by('section__order', 'order')[:self.LESSONS_PER_THREAD])
+        self.complete_concurrently([[lesson.id for lesson in lessons]] * self.THREADS)
+        self.assertExactTotals(lessons)
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class LoginTests(TestCase):
+    """A login only saves User.last_login, which nothing on the leaderboard depends on."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('learner', password='pw')
+
+    def test_login_doesnt_broadcast_or_write_the_profile(self):
+        with (mock.patch('tracker.live_stats.schedule_stats_broadcast') as schedule,
+              mock.patch('tracker.consumers.broadcast_stats_update') as broadcast):
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(self.client.login(username='learner', password='pw'))
+        schedule.assert_not_called()
+        broadcast.assert_not_called()
+        self.assertEqual(writes_to(queries, UserProfile), [])
+        self.assertEqual(writes_to(queries, LearnerStats), [])
+        # The login itself was saved
+        self.assertTrue(writes_to(queries, User))
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DashboardQueryTests(TestCase):
+    """The dashboard reads the learner's rows once (see LearnerState) and the course from
+    the in-process catalog, so its query count doesn't depend on the course or progress."""
+
+    # The session, the user, the learner's joined rows and the recent achievements
+    DASHBOARD_QUERIES = 4
+
+    def setUp(self):
+        self.user = User.objects.create_user('learner', password='pw')
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            for lesson in Lesson.objects.order_by('section__order', 'order')[:3]:
+                self.client.post(reverse('mark_complete', args=[lesson.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        # Build the process-wide catalog, rank index and active challenge list first
+        self.client.get(reverse('dashboard'))
+        # and start each test from an empty fragment cache
+        self.fragment_cache = FragmentCache(InMemoryFragmentBackend())
+        patcher = mock.patch('tracker.fragment_cache._fragment_cache', self.fragment_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cold_fragment_cache(self):
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.fragment_cache.stats()['misses'], 1)
+
+    def test_warm_fragment_cache(self):
+        self.client.get(reverse('dashboard'))
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.fragment_cache.stats()['hits'], 1)
+
+    def test_independent_of_progress(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('bulk_complete'), {'section': Lesson.objects.order_by('-section__order').first().section_id})
+        self.assertGreater(LearnerStats.objects.get(user=self.user).completion_count, 3)
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            self.client.get(reverse('dashboard'))
+
+    def test_deleted_lessons_leave_the_progress(self):
+        # The rollback brings the lesson back, which the process-wide catalog wouldn't see
+        self.addCleanup(bump_catalog_version)
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.order_by('section__order', 'order').first().delete()
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['user_completed_count'], 2)
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PageViewAchievementTests(TestCase):
+    """Page views check the rules that depend on the course's shape once per course version."""
+
+    def setUp(self):
+        # Settled rules are cached per user id, which a new test can reuse
+        cache.clear()
+        self.user = User.objects.create_user('learner', password='pw')
+        self.client.force_login(self.user)
+
+    def page_view(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return check_and_award_achievements(self.user, events=[PAGE_VIEWED])
+
+    def test_checked_once_until_the_course_changes(self):
+        self.page_view()
+        with self.assertNumQueries(0):
+            self.page_view()
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.order_by('-section__order', '-order').first().delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.page_view()
+        self.assertTrue(queries.captured_queries)
+
+    def test_removing_the_last_open_lesson_completes_the_section(self):
+        achievement = Achievement.objects.get(achievement_slug='html-foundation-complete')
+        *completed, remaining = Lesson.objects.filter(section_id=achievement.section_id).order_by('order')
+        with self.captureOnCommitCallbacks(execute=True):
+            for lesson in completed:
+                self.client.post(reverse('mark_complete', args=[lesson.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(self.page_view(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            remaining.delete()
+        self.assertIn(achievement, self.page_view())
+
+class ReevaluateUsersTests(TestCase):
+    """Backfills count a section's completions as the live checks do."""
+
+    def test_deleted_completed_lesson_no_longer_counts(self):
+        # The rollback brings the lesson back, which the process-wide catalog wouldn't see
+        self.addCleanup(bump_catalog_version)
+        user = User.objects.create_user('learner', password='pw')
+        self.client.force_login(user)
+        achievement = Achievement.objects.get(achievement_slug='html-foundation-complete')
+        first, *completed, remaining = Lesson.objects.filter(section_id=achievement.section_id).order_by('order')
+        with self.captureOnCommitCallbacks(execute=True):
+            for lesson in [first, *completed]:
+                self.client.post(reverse('mark_complete', args=[lesson.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            first.delete()
+        # One lesson of the section is still open, however many completions were recorded
+        self.assertEqual(reevaluate_users([user.id], slugs=['html-foundation-complete'], dry_run=True), {})
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AchievementsPageQueryTests(TestCase):
+    """Every locked card's progress comes from one stats snapshot, so the page costs the
+    same queries however many achievements and completions there are."""
+
+    # The session, the user, the learner's joined rows, every achievement with the user's
+    # awards, the two counts behind this month's daily challenges and the profile for the
+    # navbar's points
+    ACHIEVEMENTS_PAGE_QUERIES = 7
+
+    def setUp(self):
+        self.user = User.objects.create_user('learner', password='pw')
+        self.client.force_login(self.user)
+        # Build the process-wide catalog and active challenge list first
+        self.client.get(reverse('achievements_list'))
+
+    def complete(self, lessons):
+        with self.captureOnCommitCallbacks(execute=True):
+            for lesson in lessons:
+                self.client.post(reverse('mark_complete', args=[lesson.id]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_without_progress(self):
+        with self.assertNumQueries(self.ACHIEVEMENTS_PAGE_QUERIES):
+            response = self.client.get(reverse('achievements_list'))
+        self.assertEqual(response.context['unlocked_achievements_count'], 0)
+
+    def test_page_view_check_shares_the_achievements(self):
+        # Make the page view check evaluate again; it reads the achievements the page renders from
+        forget_settled_achievements(self.user.id)
+        with self.assertNumQueries(self.ACHIEVEMENTS_PAGE_QUERIES):
+            self.client.get(reverse('achievements_list'))
+
+    def test_independent_of_achievements_and_completions(self):
+        self.complete(Lesson.objects.order_by('section__order', 'order')[:10])
+        section = Lesson.objects.order_by('section__order').first().section
+        Achievement.objects.bulk_create([
+            Achievement(title=f'Extra {index}', description='Added by a test.', achievement_slug=f'extra-{index}', section=section)
+            for index in range(20)
+        ])
+        with self.assertNumQueries(self.ACHIEVEMENTS_PAGE_QUERIES):
+            response = self.client.get(reverse('achievements_list'))
+        self.assertGreater(response.context['unlocked_achievements_count'], 0)
+        self.assertEqual(response.context['total_achievements_count'], Achievement.objects.count())
+
+class ChallengeTypeTests(TestCase):
+    """Each evaluator in the registry, fed CompletionEvents for unsaved challenges: progress
+    comes from its arguments alone, without a query per event."""
+
+    def event(self, section_id=1, lesson_type='Lesson', points=10, streak=1, hour=9):
+        at = timezone.make_aware(datetime(2026, 1, 5, hour))
+        return CompletionEvent(section_id=section_id, lesson_type=lesson_type, points=points, streak=streak, at=at)
+
+    def progress(self, code, events, **challenge_fields):
+        """Feeds events to code's evaluator from no progress, asserting no queries run."""
+        challenge = DailyChallenge(challenge_type=code, target_value=100, **challenge_fields)
+        evaluator = get_challenge_type(code)
+        current = 0
+        for event in events:
+            with self.assertNumQueries(0):
+                current = evaluator.progress(challenge, current, event)
+        return current
+
+    def test_every_challenge_type_has_an_evaluator(self):
+        self.assertEqual(set(CHALLENGE_TYPES), {code for code, _ in DailyChallenge.CHALLENGE_TYPES})
+        self.assertIsNone(get_challenge_type('NO_SUCH_TYPE'))
+
+    def test_complete_lessons(self):
+        self.assertEqual(self.progress('COMPLETE_N_LESSONS', [self.event(), self.event(lesson_type='Project')]), 2)
+
+    def test_earn_points(self):
+        events = [self.event(points=10), self.event(points=25), self.event(points=-5)]
+        self.assertEqual(self.progress('EARN_N_POINTS', events), 35)
+
+    def test_complete_projects(self):
+        events = [self.event(lesson_type='Project'), self.event(), self.event(lesson_type='Project')]
+        self.assertEqual(self.progress('COMPLETE_PROJECT', events), 2)
+
+    def test_complete_lessons_from_section(self):
+        events = [self.event(section_id=1), self.event(section_id=2), self.event(section_id=1)]
+        self.assertEqual(self.progress('COMPLETE_N_LESSONS_FROM_SECTION', events, section_id=1), 2)
+
+    def test_earn_points_before_hour(self):
+        events = [self.event(points=10, hour=8), self.event(points=20, hour=12), self.event(points=5, hour=11)]
+        self.assertEqual(self.progress('EARN_N_POINTS_BEFORE_HOUR', events, before_hour=12), 15)
+        self.assertEqual(self.progress('EARN_N_POINTS_BEFORE_HOUR', events, before_hour=None), 0)
+
+    def test_preserve_streak(self):
+        events = [self.event(streak=3), self.event(streak=5), self.event(streak=1)]
+        self.assertEqual(self.progress('PRESERVE_STREAK', events), 5)
+
+@skipIf(FakeServer is None, "needs fakeredis (pip install fakeredis)")
+class LocalFanoutChannelLayerTests(SimpleTestCase):
+    """LocalFanoutChannelLayer behaves like the Redis layer it extends. Two layers on one
+    in-process fake Redis stand for two Daphne processes, as in benchmark_channel_layer."""
+
+    GROUP = 'live_stats'
+
+    def setUp(self):
+        from redis.asyncio import ConnectionPool
+        server = FakeServer()
+        self.layers = []
+        for _ in range(2):
+            layer = LocalFanoutChannelLayer(hosts=['redis://tests'])
+            layer.create_pool = lambda index: ConnectionPool(server=server, connection_class=FakeConnection)
+            self.layers.append(layer)
+
+    async def receive(self, layer, channel):
+        """The next message for channel, failing rather than waiting forever."""
+        return await asyncio.wait_for(layer.receive(channel), timeout=1)
+
+    async def assertNothingReceived(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), timeout=0.1)
+
+    async def test_send_and_receive(self):
+        layer, other = self.layers
+        local = await layer.new_channel()
+        await other.send(local, {'type': 'test.message', 'text': 'to a socket'})
+        self.assertEqual(await self.receive(layer, local), {'type': 'test.message', 'text': 'to a socket'})
+        # Plain (non-local) channel names go through Redis untouched
+        await layer.send('worker', {'type': 'test.message', 'text': 'to a worker'})
+        self.assertEqual((await self.receive(other, 'worker'))['text'], 'to a worker')
+
+    async def test_group_send_reaches_every_member_once(self):
+        layer, other = self.layers
+        members = {channel: layer for channel in [await layer.new_channel(), await layer.new_channel()]}
+        members[await other.new_channel()] = other
+        members['worker'] = other
+        for channel, owner in members.items():
+            await owner.group_add(self.GROUP, channel)
+        await layer.group_send(self.GROUP, {'type': 'stats.delta', 'seq': 1})
+        for channel, owner in members.items():
+            self.assertEqual((await self.receive(owner, channel))['seq'], 1)
+        for channel, owner in members.items():
+            await self.assertNothingReceived(owner, channel)
+        await layer.flush()
+
+    async def test_group_discard(self):
+        layer, other = self.layers
+        first, second, remote = await layer.new_channel(), await layer.new_channel(), await other.new_channel()
+        for channel, owner in ((first, layer), (second, layer), (remote, other)):
+            await owner.group_add(self.GROUP, channel)
+        await layer.group_discard(self.GROUP, first)
+        await layer.group_send(self.GROUP, {'type': 'stats.delta', 'seq': 1})
+        self.assertEqual((await self.receive(layer, second))['seq'], 1)
+        self.assertEqual((await self.receive(other, remote))['seq'], 1)
+        await self.assertNothingReceived(layer, first)
+        # Once its last member leaves, the process is dropped from the group in Redis
+        await layer.group_discard(self.GROUP, second)
+        await other.group_send(self.GROUP, {'type': 'stats.delta', 'seq': 2})
+        self.assertEqual((await self.receive(other, remote))['seq'], 2)
+        await self.assertNothingReceived(layer, second)
+        # Discarding from a group the channel isn't in does nothing
+        await layer.group_discard(self.GROUP, second)
+        await layer.flush()
+
+    async def test_flush(self):
+        layer, other = self.layers
+        local = await layer.new_channel()
+        await layer.group_add(self.GROUP, local)
+        await layer.send(local, {'type': 'test.message'})
+        await layer.flush()
+        await other.group_send(self.GROUP, {'type': 'stats.delta', 'seq': 1})
+        await self.assertNothingReceived(layer, local)
@@ -6,6 +6,8 @@ urlpatterns = [
     # Route for marking a lesson complete
     path('complete/<int:lesson_id>/', views.mark_complete, name='mark_complete'),
     path('uncomplete/<int:lesson_id>/', views.unmark_complete, name='unmark_complete'),
+    # Marks a whole section (or a list of lessons) complete in one request
+    path('complete/bulk/', views.bulk_complete, name='bulk_complete'),
     path('signup/', views.signup, name='signup'),
     path('settings/', views.user_settings, name='user_settings'),
     path('settings/reset/', views.reset_progress, name='reset_progress'),
@@ -13,6 +15,7 @@ urlpatterns = [
     path('settings/password/done/', views.CustomPasswordChangeDoneView.as_view(), name='password_change_done'),
     path('settings/delete_account/', views.delete_account, name='delete_account'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('leaderboard/api/', views.leaderboard_api, name='leaderboard_api'),
     path('achievements/', views.achievements_page, name='achievements_list'),
     # Optional: Redirect root to dashboard if needed later, or handle in project urls
     # path('', views.dashboard, name='home'), # Example if dashboard is the main page
@@ -0,0 +1,25 @@
+# tracker/version_stamps.py
+
+import time
+from django.core.cache import cache
+
+# Version stamps in the shared cache: whatever is built or cached from some rows carries
+# the stamp current when it was built, and changing the rows bumps it, so every process
+# drops its copy on its next read. Used for the course catalog and the settled
+# achievement rules.
+
+def _new_version():
+    # Start from the clock, so a stamp lost from the cache never matches anything built before
+    return time.time_ns()
+
+def current_version(key):
+    """The stamp stored under key, starting a new one if there is none."""
+    return cache.get_or_set(key, _new_version, timeout=None)
+
+def bump_version(key):
+    """Moves the stamp under key on, making everything built with the old one stale."""
+    cache.add(key, _new_version(), timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.delete(key) # Evicted meanwhile; the next read starts a new version
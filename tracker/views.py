@@ -1,34 +1,58 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import logging
+from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.db import transaction
 from django.db.models import Count, Q, Sum # Import Sum
 from django.contrib import messages
-from .models import Section, Lesson, Completion, UserProfile, UserStreak, UserAchievement, UserDailyChallenge, Achievement # Add UserAchievement and UserDailyChallenge
+from .models import Completion, UserProfile, UserStreak, UserAchievement, UserDailyChallenge # Add UserAchievement and UserDailyChallenge
 from django.contrib.auth.models import User # Import User
 from .forms import SignUpForm, EmailChangeForm # Updated imports
 from django.contrib.auth import login, update_session_auth_hash # Import login and update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
+from collections import namedtuple
 from datetime import date, timedelta # Add date for streak logic if not already there from models
-from .achievements import check_and_award_achievements # Import the new function
-from .daily_challenges_logic import assign_new_daily_challenge, update_daily_challenge_progress # Import new functions
+from .achievements import (achievement_progress, check_and_award_achievements, UserStats, CHALLENGE_COMPLETED,
+                           LESSON_COMPLETED, PAGE_VIEWED, POINTS_CHANGED, PROJECT_COMPLETED, STREAK_CHANGED)
+from .catalog import get_catalog
+from .challenge_types import CompletionEvent
+from .daily_challenges_logic import challenges_completed_since, update_daily_challenge_progress # Import new functions
+from .fragment_cache import get_fragment_cache
+from .leaderboard import DEFAULT_PAGE_SIZE, WINDOWS as LEADERBOARD_WINDOWS, get_leaderboard_page
+from .learner_state import get_learner_state
+from .learner_stats import (record_completion, record_completions,
+                            record_uncompletion, reset_learner_stats)
+from .rank_index import get_rank_index
+from .scoring import add_points, record_activity
 from django.urls import reverse_lazy, reverse # Import reverse
 from django.utils import timezone
-from django.http import JsonResponse # Import JsonResponse
+from django.http import Http404, JsonResponse # Import JsonResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.contrib.auth.views import PasswordChangeView, PasswordChangeDoneView
 
-# Helper function to get dashboard context data for a user
-def _get_user_dashboard_context(user):
-    profile, _ = UserProfile.objects.get_or_create(user=user)
-    user_streak, _ = UserStreak.objects.get_or_create(user=user)
-    user_daily_challenge = assign_new_daily_challenge(user) # Get current challenge status
+logger = logging.getLogger(__name__)
+
+# Helper function to get dashboard context data from a user's LearnerState
+def _get_user_dashboard_context(state):
+    user = state.user
+    profile = state.profile
+    user_streak = state.streak
+    user_daily_challenge = state.daily_challenge # Get current challenge status
     
-    total_lessons_count = Lesson.objects.count()
-    user_completed_count = Completion.objects.filter(user=user).count()
+    total_lessons_count = get_catalog().lesson_count
+    # Lessons of the current course: completion_count also counts completions of deleted lessons
+    user_completed_count = len(state.completed_lessons)
     progress_percentage = 0
     if total_lessons_count > 0:
         progress_percentage = round((user_completed_count / total_lessons_count) * 100)
 
+    # "You are #N of M", from the rank index rather than sorting every learner
+    rank_index = get_rank_index()
+    leaderboard_rank = rank_index.rank(user.id)
+    ranked_users_count = rank_index.count()
+
     # Format last activity date if it exists
     last_activity_str = user_streak.last_activity_date.strftime("%b %d") if user_streak.last_activity_date else "No activity yet"
 
@@ -45,6 +69,8 @@ def _get_user_dashboard_context(user):
         
     return {
         'total_points': profile.total_points,
+        'leaderboard_rank': leaderboard_rank,
+        'ranked_users_count': ranked_users_count,
         'progress_percentage': progress_percentage,
         'user_completed_count': user_completed_count,
         'total_lessons_count': total_lessons_count, # Keep this if needed
@@ -55,13 +81,60 @@ def _get_user_dashboard_context(user):
         # We could add recent achievements here too, but it might complicate the JSON
     }
 
+# A catalog section as the dashboard shows it to one user
+SectionProgress = namedtuple('SectionProgress', ['id', 'title', 'lessons', 'lesson_total', 'completed_count',
+                                                 'progress_percentage'])
+
+def _sections_with_progress(completed_lessons):
+    """The catalog's sections with completed_count and progress_percentage counted from a
+    CompletionBitmap, and the first unfinished section."""
+    sections, next_section = [], None
+    for section in completed_lessons.catalog.sections:
+        lesson_total = len(section.lessons)
+        completed_count = completed_lessons.completed_in_section(section.id)
+        progress_percentage = round(completed_count / lesson_total * 100) if lesson_total else 0
+        sections.append(SectionProgress(section.id, section.title, section.lessons, lesson_total, completed_count,
+                                        progress_percentage))
+        if next_section is None and completed_count < lesson_total:
+            next_section = sections[-1]
+    return sections, next_section
+
+# Stands in for the CSRF token in cached fragments; each response fills in its own
+CSRF_TOKEN_PLACEHOLDER = '__csrf_token__'
+
+def _render_sections(request, sections, next_section, completed_lessons):
+    """The dashboard's section and lesson list as HTML. It only changes with the catalog or
+    the completed lessons, so it's rendered once per catalog version and completion
+    bitmap (see fragment_cache.py), and shared by learners at the same progress."""
+    catalog = completed_lessons.catalog
+    key = f'dashboard:sections:{catalog.version}:{completed_lessons.fingerprint}'
+    fragment = get_fragment_cache().get_or_render(key, lambda: render_to_string('tracker/partials/dashboard_sections.html', {
+        'sections': sections,
+        'next_section': next_section,
+        'completed_lessons': completed_lessons,
+        'csrf_token': CSRF_TOKEN_PLACEHOLDER,
+    }))
+    return mark_safe(fragment.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request)))
+
+def _get_lesson_or_404(lesson_id):
+    lesson = get_catalog().lesson(lesson_id)
+    if lesson is None:
+        raise Http404("No such lesson.")
+    return lesson
+
 @login_required
 def dashboard(request):
     user = request.user
-    sections = Section.objects.prefetch_related('lessons').all()
-    completed_lessons = Completion.objects.filter(user=user).values_list('lesson_id', flat=True)
+    # Everything read about the user is loaded once, mostly in one query (see LearnerState)
+    state = get_learner_state(request)
+    # Sections and lessons come from the in-process course catalog, without queries, and
+    # what the user completed from the bitmap on their LearnerStats row
+    completed_lessons = state.completed_lessons
+    sections, next_section = _sections_with_progress(completed_lessons)
+    # Today's challenge, computed without writing (see todays_daily_challenge)
+    user_daily_challenge = state.daily_challenge
     # Get context using the helper
-    user_context = _get_user_dashboard_context(user)
+    user_context = _get_user_dashboard_context(state)
     # Get recent achievements separately for the main template
     recent_achievements = UserAchievement.objects.filter(user=user).select_related('achievement')[:5]
     
@@ -69,12 +142,12 @@ def dashboard(request):
     # check_and_award_achievements(user, request) # Not needed here anymore
 
     context = {
-        'sections': sections,
-        'completed_lessons': set(completed_lessons),
+        'sections_html': _render_sections(request, sections, next_section, completed_lessons),
+        'next_section': next_section,
         **user_context, # Unpack the user-specific context
         'user_achievements': recent_achievements, # Pass recent achievements
         # Pass the full daily challenge object if needed by specific template logic
-        'user_daily_challenge': assign_new_daily_challenge(user), 
+        'user_daily_challenge': user_daily_challenge,
     }
     return render(request, 'tracker/dashboard.html', context)
 
@@ -82,51 +155,58 @@ def dashboard(request):
 @require_POST
 def mark_complete(request, lesson_id):
     user = request.user
-    lesson_obj = get_object_or_404(Lesson, id=lesson_id)
+    lesson_obj = _get_lesson_or_404(lesson_id)
+    state = get_learner_state(request)
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     response_message = ""
 
     try:
+        # Only the completion's own writes share a transaction, each an atomic increment or
+        # conditional UPDATE (see scoring.py); achievements and the daily challenge are
+        # evaluated after it commits and write in short transactions of their own, so no
+        # row stays locked while they run
         with transaction.atomic():
-            # Use select_for_update on profile and streak if potential race conditions exist
-            profile = UserProfile.objects.select_for_update().get(user=user)
-            user_streak, streak_created = UserStreak.objects.select_for_update().get_or_create(user=user)
-            
-            completion, created = Completion.objects.get_or_create(user=user, lesson=lesson_obj)
-
+            completion, created = Completion.objects.get_or_create(user=user, lesson_id=lesson_obj.id)
             if created:
-                points_before = profile.total_points # Get points before update
-                profile.total_points += lesson_obj.points_value
                 points_awarded_for_lesson = lesson_obj.points_value
-                profile.save()
-                user_streak.update_streak() # Saves streak internally
-                
-                # Check achievements silently for AJAX, pass request for non-AJAX messages
-                check_and_award_achievements(user, None if is_ajax else request, 
-                                           completion_instance=completion, 
-                                           profile=profile, 
-                                           streak=user_streak)
-                
-                lesson_info_for_challenge = {'lesson_type': lesson_obj.lesson_type, 'points_earned': lesson_obj.points_value}
-                challenge_was_completed = update_daily_challenge_progress(user, None if is_ajax else request, 
-                                                                          completed_lesson_info=lesson_info_for_challenge, 
-                                                                          points_earned_in_action=points_awarded_for_lesson)
-                if challenge_was_completed:
-                    # Check daily challenge achievements silently for AJAX
-                    check_and_award_achievements(user, None if is_ajax else request, daily_challenge_completed=True)
-
-                response_message = f"'{lesson_obj.title}' marked as complete! (+{points_awarded_for_lesson} points)"
-                if not is_ajax:
-                    messages.success(request, f"{response_message} Streak: {user_streak.current_streak} day(s)!")
-                
-            else: # Already completed
-                response_message = f"'{lesson_obj.title}' was already marked as complete."
-                if not is_ajax:
-                    messages.info(request, response_message)
+                add_points(user, points_awarded_for_lesson)
+                record_completion(user, lesson_obj)
+                current_streak = record_activity(user)
+
+        if created:
+            # Check achievements silently for AJAX, pass request for non-AJAX messages
+            events = [LESSON_COMPLETED, POINTS_CHANGED, STREAK_CHANGED]
+            if lesson_obj.lesson_type == 'Project':
+                events.append(PROJECT_COMPLETED)
+            unlocked = check_and_award_achievements(user, None if is_ajax else request, events=events, state=state)
+
+            # Everything the daily challenge needs to know about this completion
+            challenge_event = CompletionEvent(
+                section_id=lesson_obj.section_id,
+                lesson_type=lesson_obj.lesson_type,
+                points=points_awarded_for_lesson + sum(achievement.points_reward for achievement in unlocked),
+                streak=current_streak,
+                at=timezone.now(),
+            )
+            challenge_was_completed = update_daily_challenge_progress(user, [challenge_event], None if is_ajax else request)
+            if challenge_was_completed:
+                state.refresh() # The reward changed points
+                # Check daily challenge achievements silently for AJAX
+                check_and_award_achievements(user, None if is_ajax else request,
+                                             events=[CHALLENGE_COMPLETED, POINTS_CHANGED], state=state)
+
+            response_message = f"'{lesson_obj.title}' marked as complete! (+{points_awarded_for_lesson} points)"
+            if not is_ajax:
+                messages.success(request, f"{response_message} Streak: {current_streak} day(s)!")
+        else: # Already completed
+            response_message = f"'{lesson_obj.title}' was already marked as complete."
+            if not is_ajax:
+                messages.info(request, response_message)
         
         # If successful, return updated context for AJAX
         if is_ajax:
-            updated_context = _get_user_dashboard_context(user)
+            state.refresh()
+            updated_context = _get_user_dashboard_context(state)
             return JsonResponse({'status': 'ok', 'message': response_message, 'context': updated_context})
             
     except Exception as e:
@@ -143,20 +223,19 @@ def mark_complete(request, lesson_id):
 @require_POST
 def unmark_complete(request, lesson_id):
     user = request.user
-    lesson = get_object_or_404(Lesson, id=lesson_id)
+    lesson = _get_lesson_or_404(lesson_id)
+    state = get_learner_state(request)
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     response_message = ""
 
     try:
         with transaction.atomic():
-            profile = UserProfile.objects.select_for_update().get(user=user)
-            completion = Completion.objects.filter(user=user, lesson=lesson).first()
-            
-            if completion:
+            completion = Completion.objects.filter(user=user, lesson_id=lesson.id).first()
+            # Only the request whose DELETE removed the row takes the points back
+            if completion and Completion.objects.filter(pk=completion.pk).delete()[0]:
                 points_to_subtract = lesson.points_value
-                profile.total_points = max(0, profile.total_points - points_to_subtract)
-                profile.save()
-                completion.delete()
+                add_points(user, -points_to_subtract)
+                record_uncompletion(user, lesson, completed_on=completion.completed_at.date())
                 # Note: Not recalculating streak/achievements on unmark for simplicity now
                 response_message = f"'{lesson.title}' marked as incomplete. (-{points_to_subtract} points)"
                 if not is_ajax:
@@ -167,7 +246,8 @@ def unmark_complete(request, lesson_id):
                     messages.info(request, response_message)
         
         if is_ajax:
-            updated_context = _get_user_dashboard_context(user)
+            state.refresh()
+            updated_context = _get_user_dashboard_context(state)
             return JsonResponse({'status': 'ok', 'message': response_message, 'context': updated_context})
 
     except Exception as e:
@@ -180,6 +260,97 @@ def unmark_complete(request, lesson_id):
 
     return redirect('dashboard')
 
+@login_required
+@require_POST
+def bulk_complete(request):
+    """Marks many lessons complete at once: every lesson of the posted `section`, or the
+    posted `lesson_ids`.
+
+    The completions are inserted with one bulk insert, and their points, counters and
+    streak applied once, in one transaction; achievements and the daily challenge are
+    then evaluated once for the whole batch, as mark_complete does for one lesson.
+    """
+    user = request.user
+    state = get_learner_state(request)
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    catalog = get_catalog()
+    section_id = request.POST.get('section', '')
+    if section_id.isdigit():
+        lessons = list(catalog.section_lessons(int(section_id)))
+    else:
+        lessons = {catalog.lesson(int(value)) for value in request.POST.getlist('lesson_ids') if value.isdigit()}
+        lessons = sorted((lesson for lesson in lessons if lesson), key=lambda lesson: lesson.position)
+    if not lessons:
+        response_message = "No lessons to mark as complete."
+        if is_ajax:
+            return JsonResponse({'status': 'error', 'message': response_message}, status=400)
+        messages.error(request, response_message)
+        return redirect('dashboard')
+
+    try:
+        with transaction.atomic():
+            done = set(Completion.objects.filter(user=user, lesson_id__in=[lesson.id for lesson in lessons])
+                       .values_list('lesson_id', flat=True))
+            completions = [Completion(user=user, lesson_id=lesson.id) for lesson in lessons if lesson.id not in done]
+            Completion.objects.bulk_create(completions, ignore_conflicts=True)
+            # ignore_conflicts doesn't say which rows were skipped because another request
+            # completed the lesson meanwhile; ours are the ones with the completed_at each
+            # instance was stamped with
+            stamped = dict(Completion.objects.filter(user=user, lesson__in=[completion.lesson_id for completion in completions])
+                           .values_list('lesson_id', 'completed_at'))
+            new_lessons = [catalog.lesson(completion.lesson_id) for completion in completions
+                           if stamped.get(completion.lesson_id) == completion.completed_at]
+            points_awarded = sum(lesson.points_value for lesson in new_lessons)
+            if new_lessons:
+                add_points(user, points_awarded)
+                record_completions(user, new_lessons)
+                current_streak = record_activity(user)
+
+        if new_lessons:
+            events = [LESSON_COMPLETED, POINTS_CHANGED, STREAK_CHANGED]
+            if any(lesson.lesson_type == 'Project' for lesson in new_lessons):
+                events.append(PROJECT_COMPLETED)
+            unlocked = check_and_award_achievements(user, None if is_ajax else request, events=events, state=state)
+
+            # One event per lesson, in course order; achievement bonuses count with the last
+            now = timezone.now()
+            challenge_events = [
+                CompletionEvent(section_id=lesson.section_id, lesson_type=lesson.lesson_type,
+                                points=lesson.points_value, streak=current_streak, at=now)
+                for lesson in new_lessons
+            ]
+            bonus = sum(achievement.points_reward for achievement in unlocked)
+            challenge_events[-1] = challenge_events[-1]._replace(points=challenge_events[-1].points + bonus)
+            if update_daily_challenge_progress(user, challenge_events, None if is_ajax else request):
+                state.refresh() # The reward changed points
+                check_and_award_achievements(user, None if is_ajax else request,
+                                             events=[CHALLENGE_COMPLETED, POINTS_CHANGED], state=state)
+
+            response_message = f"{len(new_lessons)} lesson(s) marked as complete! (+{points_awarded} points)"
+            if not is_ajax:
+                messages.success(request, f"{response_message} Streak: {current_streak} day(s)!")
+        else:
+            response_message = "Those lessons were already marked as complete."
+            if not is_ajax:
+                messages.info(request, response_message)
+
+        if is_ajax:
+            state.refresh()
+            updated_context = _get_user_dashboard_context(state)
+            return JsonResponse({'status': 'ok', 'message': response_message,
+                                 'completed_lesson_ids': [lesson.id for lesson in new_lessons],
+                                 'context': updated_context})
+
+    except Exception as e:
+        logger.exception("Error in bulk_complete for user %s", user.id)
+        response_message = f'An error occurred: {e}'
+        if is_ajax:
+            return JsonResponse({'status': 'error', 'message': response_message}, status=500)
+        else:
+            messages.error(request, response_message)
+
+    return redirect('dashboard')
+
 def signup(request):
     if request.method == 'POST':
         form = SignUpForm(request.POST)
@@ -296,6 +467,9 @@ def reset_progress(request):
                 # Alternatively, delete it: daily_challenge_instance.delete()
                 # and let it be recreated on next dashboard load. Resetting fields is safer.
 
+            # 6. Clear the LearnerStats counters (points and streak were mirrored by the saves above)
+            reset_learner_stats(user)
+
             messages.success(request, "Your progress has been successfully reset!")
 
     except Exception as e:
@@ -309,54 +483,61 @@ def reset_progress(request):
 @login_required
 def leaderboard(request):
     user = request.user
-    check_and_award_achievements(user, request, view_context='leaderboard')
-    # Get all users with their profiles, streaks, completions, achievements, and daily challenge status
-    users = User.objects.filter(is_active=True).select_related('profile', 'streak').prefetch_related('completions', 'achievements', 'daily_challenge_instance')
-
-    leaderboard_data = []
-    for u in users:
-        profile = getattr(u, 'profile', None)
-        streak = getattr(u, 'streak', None)
-        completions_count = u.completions.count()
-        achievements_count = u.achievements.count()
-        daily_challenge = getattr(u, 'daily_challenge_instance', None)
-        daily_challenge_completed = daily_challenge.is_completed if daily_challenge else False
-        leaderboard_data.append({
-            'username': u.username,
-            'total_points': profile.total_points if profile else 0,
-            'current_streak': streak.current_streak if streak else 0,
-            'longest_streak': streak.longest_streak if streak else 0,
-            'lessons_completed': completions_count,
-            'achievements_earned': achievements_count,
-            'daily_challenge_completed': daily_challenge_completed,
-        })
-
-    # Sort by total_points descending, then lessons_completed, then achievements_earned
-    leaderboard_data.sort(key=lambda x: (-x['total_points'], -x['lessons_completed'], -x['achievements_earned']))
+    check_and_award_achievements(user, request, events=[PAGE_VIEWED], state=get_learner_state(request))
+    # ?window=day|week|month ranks points earned in that window; anything else is all time
+    window = request.GET.get('window')
+    window = window if window in LEADERBOARD_WINDOWS else None
+    # One page of the leaderboard, counted and ranked in the database (see leaderboard.py)
+    leaderboard_data, next_cursor = get_leaderboard_page(after=request.GET.get('after'), window=window)
 
     context = {
         'leaderboard': leaderboard_data,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
+        'window': window,
     }
     return render(request, 'tracker/leaderboard.html', context)
 
+@login_required
+def leaderboard_api(request):
+    """Returns one page of the leaderboard as JSON; pass ?after=<next> for the following page.
+
+    ?window=day|week|month ranks points earned in that window instead of all time.
+    """
+    try:
+        page_size = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    window = request.GET.get('window')
+    if window and window not in LEADERBOARD_WINDOWS:
+        return JsonResponse({'error': f"window must be one of: {', '.join(LEADERBOARD_WINDOWS)}"}, status=400)
+    entries, next_cursor = get_leaderboard_page(after=request.GET.get('after'), page_size=page_size, window=window)
+    for entry in entries:
+        entry.pop('user_id') # Internal; the cursor carries what pagination needs
+    return JsonResponse({'results': entries, 'next': next_cursor, 'window': window or 'all'})
+
 @login_required
 def achievements_page(request):
     user = request.user
-    check_and_award_achievements(user, request, view_context='achievements')
-    all_system_achievements = Achievement.objects.all().order_by('title')
-    user_unlocked_achievements = UserAchievement.objects.filter(user=user).select_related('achievement')
-    
-    user_unlocked_ids = {ua.achievement_id for ua in user_unlocked_achievements}
-    user_unlocked_map = {ua.achievement_id: ua.awarded_at for ua in user_unlocked_achievements}
+    state = get_learner_state(request)
+    check_and_award_achievements(user, request, events=[PAGE_VIEWED], state=state)
+    # Every achievement (ordered by title) with the user's earned flag and award time, in
+    # one query shared with the check above
+    all_system_achievements = state.achievements
+    # One stats snapshot (a fixed number of queries) feeds the progress of every locked card
+    stats = UserStats.load(state)
 
     all_achievements_data = []
     unlocked_achievements_data = []
     locked_achievements_data = []
 
     for ach in all_system_achievements:
-        is_unlocked = ach.id in user_unlocked_ids
-        awarded_at = user_unlocked_map.get(ach.id) if is_unlocked else None
-        data_obj = {'instance': ach, 'is_unlocked': is_unlocked, 'awarded_at': awarded_at}
+        is_unlocked = ach.earned
+        data_obj = {'instance': ach, 'is_unlocked': is_unlocked, 'awarded_at': ach.awarded_at}
+        if not is_unlocked:
+            progress = achievement_progress(stats, ach)
+            if progress:
+                data_obj['progress_current'], data_obj['progress_target'] = progress
         
         all_achievements_data.append(data_obj)
         if is_unlocked:
@@ -364,8 +545,12 @@ def achievements_page(request):
         else:
             locked_achievements_data.append(data_obj)
             
-    total_achievements_count = all_system_achievements.count()
+    total_achievements_count = len(all_system_achievements)
     unlocked_count = len(unlocked_achievements_data)
+    # Daily challenge stats: the streak from the LearnerStats counters, this month's count
+    # from the challenge history
+    learner_stats = state.learner_stats
+    month_start = timezone.now().date().replace(day=1)
 
     context = {
         'all_achievements_data': all_achievements_data,
@@ -374,6 +559,9 @@ def achievements_page(request):
         'total_achievements_count': total_achievements_count,
         'unlocked_achievements_count': unlocked_count,
         'locked_achievements_count': total_achievements_count - unlocked_count,
+        'challenges_this_month': challenges_completed_since(user, month_start),
+        'challenge_streak': learner_stats.current_challenge_streak,
+        'longest_challenge_streak': learner_stats.longest_challenge_streak,
     }
     return render(request, 'tracker/achievements_list.html', context)
 